@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Batch processing of spherometer measurements
+
+Walks a folder laid out as <mirror>/<date>/*.csv (e.g. M18/20250825/) and processes every
+concentric measurement in it across a pool of worker processes.
+
+Run as a script for unattended (headless) reprocessing, e.g.
+    python batch_processing.py mirrors/M18 --output results/M18 --workers 8
+which writes ROC and sag PNGs for every file plus a summary.csv (file, mean ROC, PV, RMS).
+Add --profile to also write profile.jsonl, one JSON record of stage timings and counts per file.
+"""
+
+import argparse
+import csv
+import json
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from spherometer_utils import process_spherometer_concentric, compute_roc
+from result_cache import cached_process_concentric
+from profiling import StageProfiler, profile_stage
+
+DEFAULT_CONFIG = {'measurement_radius': [11.875, 8.5, 5.25, 2],
+                  'spherometer_diameter': 11.5,
+                  'object_diameter': 32,
+                  'number_of_pixels': 256,
+                  'crop_clear_aperture': True,
+                  'concave': True,
+                  'sag_unit': 'in',
+                  'dtype': 'float64',
+                  'footprint': 'hard',
+                  'smoothing_sigma': None,
+                  'cache_dir': None}
+
+
+def find_measurement_files(root, extension='.csv'):
+    # Every measurement file below root, in a stable (sorted) order
+    measurement_files = []
+    for folder, subfolders, files in os.walk(root):
+        subfolders.sort()
+        for file in sorted(files):
+            if file.endswith(extension):
+                measurement_files.append(os.path.join(folder, file))
+    return measurement_files
+
+
+def process_measurement_file(csv_file, config, output_dir=None, keep_maps=True, profile=False, trace_memory=False):
+    #   csv_file: concentric measurement csv
+    #   config: processing parameters, see DEFAULT_CONFIG
+    #   output_dir: if given, ROC and sag PNGs are rendered there (Agg, no display needed)
+    #   keep_maps: set to False to drop the maps from the result, e.g. when only the summary is needed
+    #   profile: record stage timings and counts in 'profile' (see profiling.StageProfiler);
+    #   trace_memory adds tracemalloc peaks per stage
+    #   Returns a dict with the ROC and sag maps, mean ROC, ROC PV and RMS, and sag statistics.
+    #   Failures are reported in 'error' instead of raised so that one bad file does not stop a batch run.
+    session_folder = os.path.dirname(os.path.abspath(csv_file))
+    result = {'file': csv_file,
+              'mirror': os.path.basename(os.path.dirname(session_folder)),
+              'session': os.path.basename(session_folder),
+              'roc': None,
+              'sag': None,
+              'mean_roc': np.nan,
+              'pv_roc': np.nan,
+              'rms_roc': np.nan,
+              'sag_stats': None,
+              'figures': [],
+              'profile': None,
+              'error': None}
+    profiler = StageProfiler(label=csv_file, trace_memory=trace_memory) if profile else None
+
+    try:
+        if config['cache_dir']:
+            cropped_data, smoothed_data, roc = cached_process_concentric(
+                csv_file,
+                measurement_radius=config['measurement_radius'],
+                spherometer_diameter=config['spherometer_diameter'],
+                object_diameter=config['object_diameter'],
+                number_of_pixels=config['number_of_pixels'],
+                crop_clear_aperture=config['crop_clear_aperture'],
+                sag_unit=config['sag_unit'],
+                concave=config['concave'],
+                cache_dir=config['cache_dir'],
+                profiler=profiler,
+                dtype=config['dtype'],
+                footprint=config['footprint'],
+                smoothing_sigma=config['smoothing_sigma'])
+        else:
+            cropped_data, smoothed_data, mirror_extent = process_spherometer_concentric(
+                csv_file,
+                measurement_radius=config['measurement_radius'],
+                spherometer_diameter=config['spherometer_diameter'],
+                object_diameter=config['object_diameter'],
+                number_of_pixels=config['number_of_pixels'],
+                crop_clear_aperture=config['crop_clear_aperture'],
+                sag_unit=config['sag_unit'],
+                profiler=profiler,
+                dtype=config['dtype'],
+                footprint=config['footprint'],
+                smoothing_sigma=config['smoothing_sigma'])
+
+            with profile_stage(profiler, 'roc'):
+                roc = compute_roc(smoothed_data, config['spherometer_diameter'], concave=config['concave'])
+
+        sags = smoothed_data[np.isfinite(smoothed_data)]
+        if sags.size == 0:
+            raise ValueError('No valid sag readings in ' + csv_file)
+
+        result['roc'] = np.flip(roc, 0)
+        result['sag'] = np.flip(smoothed_data, 0)
+        result['mean_roc'] = np.nanmean(roc)
+        result['pv_roc'] = np.nanmax(roc) - np.nanmin(roc)
+        result['rms_roc'] = np.nanstd(roc)
+        result['sag_stats'] = {'mean': np.mean(sags),
+                               'min': np.min(sags),
+                               'max': np.max(sags),
+                               'std': np.std(sags),
+                               'pixels': sags.size}
+
+        if output_dir:
+            with profile_stage(profiler, 'import_matplotlib'):
+                from roc_plotting import import_matplotlib
+                import_matplotlib()
+            with profile_stage(profiler, 'render'):
+                result['figures'] = render_result(result, config, output_dir)
+        if not keep_maps:
+            result['roc'] = None
+            result['sag'] = None
+    except Exception:
+        result['error'] = traceback.format_exc()
+
+    if profiler is not None:
+        profiler.stop()
+        result['profile'] = profiler.summary()
+    return result
+
+
+def render_result(result, config, output_dir):
+    # ROC and sag PNGs for one processed file, named <mirror>_<session>_<file>_{roc,sag}.png
+    from roc_plotting import render_roc_png, render_sag_png
+
+    os.makedirs(output_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(result['file']))[0]
+    title = result['mirror'] + ' ' + result['session'] + ' ' + name
+    stem = os.path.join(output_dir, '_'.join([result['mirror'], result['session'], name]))
+
+    render_roc_png(stem + '_roc.png', result['roc'], result['sag'], title)
+    render_sag_png(stem + '_sag.png', result['sag'], title, config['spherometer_diameter'])
+    return [stem + '_roc.png', stem + '_sag.png']
+
+
+def process_directory(root, config=None, workers=None, extension='.csv', output_dir=None, keep_maps=True,
+                      profile=False, trace_memory=False):
+    #   root: folder holding mirror/date subfolders, a single mirror folder, or a single session folder
+    #   config: processing parameters overriding DEFAULT_CONFIG
+    #   workers: number of worker processes (None uses every core, 1 runs serially in this process)
+    #   output_dir, keep_maps, profile, trace_memory: see process_measurement_file; figures are rendered
+    #   and profiled in the workers
+    #   Returns one result dict per file (see process_measurement_file), in sorted file order
+    full_config = dict(DEFAULT_CONFIG)
+    if config:
+        full_config.update(config)
+
+    measurement_files = find_measurement_files(root, extension=extension)
+    process_file = partial(process_measurement_file, config=full_config, output_dir=output_dir, keep_maps=keep_maps,
+                           profile=profile, trace_memory=trace_memory)
+    if workers == 1 or len(measurement_files) <= 1:
+        return [process_file(csv_file) for csv_file in measurement_files]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(process_file, measurement_files))
+
+
+def write_summary_csv(results, csv_path):
+    # One row per file: file, mirror, session, mean ROC, PV and RMS (mm), and the error if it failed
+    with open(csv_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['file', 'mirror', 'session', 'mean_roc_mm', 'pv_roc_mm', 'rms_roc_mm', 'error'])
+        for result in results:
+            error = result['error'].strip().splitlines()[-1] if result['error'] else ''
+            writer.writerow([result['file'], result['mirror'], result['session'],
+                             '%.2f' % result['mean_roc'], '%.2f' % result['pv_roc'], '%.2f' % result['rms_roc'], error])
+
+
+def write_profile_jsonl(results, jsonl_path):
+    # One JSON record per profiled file (see profiling.StageProfiler.summary), for aggregate analysis
+    with open(jsonl_path, 'w', encoding='utf-8') as file:
+        for result in results:
+            if result['profile'] is not None:
+                file.write(json.dumps(result['profile'], default=float) + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Process every spherometer measurement below a folder and write '
+                                                 'ROC/sag PNGs plus a summary csv.')
+    parser.add_argument('root', help='folder holding <mirror>/<date>/*.csv measurements')
+    parser.add_argument('--output', required=True, help='folder for the PNGs and summary.csv')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: every core)')
+    parser.add_argument('--radii', type=float, nargs='+', default=DEFAULT_CONFIG['measurement_radius'],
+                        help='measurement radius of each csv row (in)')
+    parser.add_argument('--spherometer-diameter', type=float, default=DEFAULT_CONFIG['spherometer_diameter'])
+    parser.add_argument('--object-diameter', type=float, default=DEFAULT_CONFIG['object_diameter'])
+    parser.add_argument('--pixels', type=int, default=DEFAULT_CONFIG['number_of_pixels'])
+    parser.add_argument('--sag-unit', choices=['in', 'mm'], default=DEFAULT_CONFIG['sag_unit'])
+    parser.add_argument('--no-crop', action='store_true', help='do not crop to the clear aperture')
+    parser.add_argument('--convex', action='store_true', help='surface is convex')
+    parser.add_argument('--footprint', choices=['hard', 'area'], default=DEFAULT_CONFIG['footprint'],
+                        help="'area' weights pixels by the share the spherometer footprint covers (anti-aliased)")
+    parser.add_argument('--smoothing-sigma', type=float, default=DEFAULT_CONFIG['smoothing_sigma'],
+                        help='Gaussian smoothing width in inches (default: 7 pixels)')
+    parser.add_argument('--float32', action='store_true', help='compute maps in float32 (half the memory)')
+    parser.add_argument('--cache-dir', default=None, help='on-disk result cache (see result_cache)')
+    parser.add_argument('--profile', action='store_true', help='write per-file stage timings to profile.jsonl')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='also record tracemalloc peaks per stage (implies --profile, slower)')
+    args = parser.parse_args(argv)
+
+    config = {'measurement_radius': args.radii,
+              'spherometer_diameter': args.spherometer_diameter,
+              'object_diameter': args.object_diameter,
+              'number_of_pixels': args.pixels,
+              'crop_clear_aperture': not args.no_crop,
+              'concave': not args.convex,
+              'sag_unit': args.sag_unit,
+              'dtype': 'float32' if args.float32 else 'float64',
+              'footprint': args.footprint,
+              'smoothing_sigma': args.smoothing_sigma,
+              'cache_dir': args.cache_dir}
+
+    results = process_directory(args.root, config, workers=args.workers, output_dir=args.output, keep_maps=False,
+                                profile=args.profile or args.profile_memory, trace_memory=args.profile_memory)
+    os.makedirs(args.output, exist_ok=True)
+    write_summary_csv(results, os.path.join(args.output, 'summary.csv'))
+    if args.profile or args.profile_memory:
+        write_profile_jsonl(results, os.path.join(args.output, 'profile.jsonl'))
+
+    failed = [result for result in results if result['error']]
+    print('Processed ' + str(len(results)) + ' files, ' + str(len(failed)) + ' failed')
+    for result in failed:
+        print('  ' + result['file'] + ': ' + result['error'].strip().splitlines()[-1])
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the spherometer processing pipeline
+
+- Times the original per-pixel list accumulation against the footprint accumulation engine
+  in spherometer_utils and checks that both return identical maps.
+- Times the parse / accumulate / smooth / ROC stages across pixel counts and reading counts.
+- Checks that the known mean ROC of synthetic surfaces is recovered (raises AssertionError if not).
+- Reports how the mean ROC converges with the number of pixels for hard and area-weighted
+  footprints, with the smoothing width fixed in pixels (default) or in inches.
+Runs offline on synthetic measurements (see synthetic_measurements) written to a temporary folder.
+"""
+
+import csv
+import os
+import tempfile
+import time
+
+import numpy as np
+from scipy import ndimage
+
+from spherometer_utils import (process_spherometer_concentric, process_spherometer_grid, concentric_axes,
+                               accumulate_footprints, finish_concentric_map, compute_roc, clear_stencil_caches)
+from measurement_io import read_concentric_csv
+from synthetic_measurements import write_concentric_measurement, write_grid_measurement, spherometer_sag
+
+ABERRATIONS = {'defocus': 2e-4, 'coma_x': 5e-5, 'spherical': -1e-4}
+
+
+#%% Reference implementation (per-pixel list accumulation)
+
+def legacy_process_spherometer_concentric(csv_file, measurement_radius=[11.875, 8.5, 5.25, 2], spherometer_diameter=11.5,
+                                          object_diameter=32, number_of_pixels=256, crop_clear_aperture=False, sag_unit='in'):
+    spher_radius = spherometer_diameter / 2
+    mirror_radius = object_diameter / 2
+    gauss_filter_radius = 7
+    sigma = 7
+    ca_OD = 30
+    ca_ID = 3
+
+    with open(csv_file, mode='r', encoding='utf-8-sig') as file:
+        reader = csv.reader(file)
+        data = list(reader)
+
+    x = np.linspace(-mirror_radius, mirror_radius, int(number_of_pixels))
+    y = np.linspace(-mirror_radius, mirror_radius, int(number_of_pixels))
+
+    X, Y = np.meshgrid(x, y)
+
+    fill_data = [[] for i in range(X.size)]
+    avg_data = list([0] * len(fill_data))
+
+    for meas_index, measurement_set in enumerate(data):
+        radius = measurement_radius[meas_index]
+        meas_data = [i for i in measurement_set if i != "" and i != "0"]
+
+        theta = np.linspace(0, 2 * np.pi, len(meas_data), endpoint=False)
+
+        for num, sag in enumerate(meas_data):
+            try:
+                x_pos = radius * np.cos(theta[num])
+                y_pos = radius * np.sin(theta[num])
+
+                distance_from_center = np.sqrt(np.power(X - x_pos, 2) + np.power(Y - y_pos, 2))
+                spher_extent = distance_from_center < spher_radius
+                float(sag)
+
+                coord = np.where(spher_extent)
+
+                for index_num, loc in enumerate(coord[0]):
+                    index = loc * X.shape[0] + coord[1][index_num]
+                    fill_data[index].append(float(sag))
+            except ValueError:
+                continue
+
+    for num, val in enumerate(fill_data):
+        if len(val) == 0:
+            avg_data[num] = np.nan
+        else:
+            avg_data[num] = np.mean(val)
+
+    reshaped_data = np.reshape(avg_data, X.shape)
+    distance_from_center = np.sqrt(np.power(X, 2) + np.power(Y, 2))
+    cropped_data = reshaped_data.copy()
+
+    if not sag_unit == 'in':
+        cropped_data = cropped_data / 25.4
+
+    smoothed_data = ndimage.gaussian_filter(cropped_data, sigma, radius=gauss_filter_radius)
+
+    if crop_clear_aperture:
+        mirror_extent = (distance_from_center < ca_OD / 2) * (distance_from_center > ca_ID / 2)
+    else:
+        mirror_extent = distance_from_center < mirror_radius
+
+    smoothed_data[~mirror_extent] = np.nan
+    cropped_data[~mirror_extent] = np.nan
+
+    return cropped_data, smoothed_data, mirror_extent
+
+
+def legacy_process_spherometer_grid(csv_file, size_of_square=3, number_of_squares=10, pixels_per_square=10, spherometer_diameter=11.5,
+                                    object_diameter=28, mirror_center_x=5, mirror_center_y=5):
+    spher_radius = spherometer_diameter / 2 / size_of_square
+    mirror_radius = object_diameter / 2 / size_of_square
+    sigma = 3
+
+    with open(csv_file, mode='r', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        data = list(reader)
+
+    x = np.linspace(0, number_of_squares, number_of_squares * pixels_per_square)
+    y = np.linspace(0, number_of_squares, number_of_squares * pixels_per_square)
+
+    X, Y = np.meshgrid(x, y)
+
+    fill_data = [[] for i in range(X.size)]
+    avg_data = list([0] * len(fill_data))
+
+    for num, sag in enumerate(data[0]):
+        if sag != '0':
+            x_pos = num % number_of_squares
+            y_pos = np.floor(num / number_of_squares)
+
+            distance_from_center = np.sqrt(np.power(X - x_pos, 2) + np.power(Y - y_pos, 2))
+            coord = np.where(distance_from_center < spher_radius)
+
+            for index_num, loc in enumerate(coord[0]):
+                index = loc * X.shape[0] + coord[1][index_num]
+                fill_data[index].append(float(sag))
+
+    for num, val in enumerate(fill_data):
+        if len(val) == 0:
+            avg_data[num] = np.nan
+        else:
+            avg_data[num] = np.mean(val)
+
+    reshaped_data = np.reshape(avg_data, X.shape)
+    distance_from_center = np.sqrt(np.power(X - mirror_center_x, 2) + np.power(Y - mirror_center_y, 2))
+    mirror_extent = distance_from_center < mirror_radius
+    cropped_data = reshaped_data.copy()
+
+    smoothed_data = ndimage.gaussian_filter(cropped_data, sigma, radius=3)
+    smoothed_data[~mirror_extent] = np.nan
+
+    cropped_data[~mirror_extent] = np.nan
+
+    return cropped_data, smoothed_data, mirror_extent
+
+
+#%% Benchmark
+
+def time_call(function, *args, repeats=1, **kwargs):
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = function(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, output
+
+
+def compare_paths(label, legacy_function, new_function, csv_file, repeats, run_legacy, **kwargs):
+    new_time, new_output = time_call(new_function, csv_file, repeats=repeats, **kwargs)
+    if not run_legacy:
+        print('%8s %12s %12.4f %9s %10s' % (label, '-', new_time, '-', '-'))
+        return
+
+    old_time, old_output = time_call(legacy_function, csv_file, **kwargs)
+    identical = all(np.array_equal(new, old, equal_nan=True) for new, old in zip(new_output, old_output))
+    print('%8s %12.4f %12.4f %9.1f %10s' % (label, old_time, new_time, old_time / new_time, identical))
+    assert identical, 'Engine output differs from the legacy path at ' + label
+
+
+def run_concentric_benchmark(pixel_counts=[64, 128, 256, 512], repeats=3, legacy_max_pixels=512):
+    with tempfile.TemporaryDirectory() as folder:
+        csv_file = os.path.join(folder, 'synthetic_concentric.csv')
+        write_concentric_measurement(csv_file, aberrations=ABERRATIONS, noise=0.0005, seed=0)
+
+        print('Concentric')
+        print('%8s %12s %12s %9s %10s' % ('pixels', 'legacy (s)', 'engine (s)', 'speedup', 'identical'))
+        for number_of_pixels in pixel_counts:
+            compare_paths(str(number_of_pixels), legacy_process_spherometer_concentric, process_spherometer_concentric,
+                          csv_file, repeats, number_of_pixels <= legacy_max_pixels, number_of_pixels=number_of_pixels)
+
+
+def run_grid_benchmark(pixels_per_square=[5, 10, 20, 40], repeats=3, legacy_max_pixels_per_square=40):
+    with tempfile.TemporaryDirectory() as folder:
+        csv_file = os.path.join(folder, 'synthetic_grid.csv')
+        write_grid_measurement(csv_file, aberrations=ABERRATIONS, noise=0.0005, seed=0)
+
+        print('Grid')
+        print('%8s %12s %12s %9s %10s' % ('px/sq', 'legacy (s)', 'engine (s)', 'speedup', 'identical'))
+        for pixels in pixels_per_square:
+            compare_paths(str(pixels), legacy_process_spherometer_grid, process_spherometer_grid,
+                          csv_file, repeats, pixels <= legacy_max_pixels_per_square, pixels_per_square=pixels)
+
+
+def time_stages(csv_file, measurement_radius, number_of_pixels, spherometer_diameter=11.5, object_diameter=32,
+                repeats=3):
+    # Best-of-repeats wall time of each pipeline stage, with a cold footprint stencil cache
+    stages = {'parse': np.inf, 'accumulate': np.inf, 'smooth': np.inf, 'roc': np.inf}
+    for _ in range(repeats):
+        clear_stencil_caches()
+        start = time.perf_counter()
+        readings, skipped = read_concentric_csv(csv_file, measurement_radius)
+        readings = readings[readings['valid']]
+        parsed = time.perf_counter()
+        x, y = concentric_axes(object_diameter, number_of_pixels)
+        avg_data = accumulate_footprints(x, y, readings['x'], readings['y'], readings['sag'], spherometer_diameter / 2)
+        accumulated = time.perf_counter()
+        cropped_data, smoothed_data, mirror_extent = finish_concentric_map(np.reshape(avg_data, (y.size, x.size)), x, y,
+                                                                           object_diameter, crop_clear_aperture=True)
+        smoothed = time.perf_counter()
+        compute_roc(smoothed_data, spherometer_diameter)
+        done = time.perf_counter()
+
+        for stage, seconds in zip(stages, [parsed - start, accumulated - parsed, smoothed - accumulated, done - smoothed]):
+            stages[stage] = min(stages[stage], seconds)
+    return stages
+
+
+def run_stage_benchmark(pixel_counts=[64, 128, 256, 512, 1024],
+                        readings_per_ring=[[12, 9, 6, 3], [24, 18, 12, 6], [48, 36, 24, 12]], repeats=3):
+    measurement_radius = [11.875, 8.5, 5.25, 2]
+    with tempfile.TemporaryDirectory() as folder:
+        print('Stages (s)')
+        print('%8s %9s %10s %11s %10s %10s' % ('pixels', 'readings', 'parse', 'accumulate', 'smooth', 'roc'))
+        for counts in readings_per_ring:
+            csv_file = os.path.join(folder, 'synthetic_%d.csv' % sum(counts))
+            write_concentric_measurement(csv_file, measurement_radius, counts, aberrations=ABERRATIONS, noise=0.0005, seed=0)
+            for number_of_pixels in pixel_counts:
+                stages = time_stages(csv_file, measurement_radius, number_of_pixels, repeats=repeats)
+                print('%8d %9d %10.4f %11.4f %10.4f %10.4f' % (number_of_pixels, sum(counts), stages['parse'],
+                                                              stages['accumulate'], stages['smooth'], stages['roc']))
+
+
+def expected_mean_roc(x, y, mirror_extent, roc, concave=True, aberrations=None, mirror_radius=16):
+    # Mean ROC (mm) of the noise-free spherometer sag at every map pixel inside mirror_extent
+    #   x, y: pixel coordinates of the map (in, centered on the mirror)
+    # Equal to roc for a sphere; with aberrations it is what an ideal reconstruction should read
+    sag = spherometer_sag(x[np.newaxis, :], y[:, np.newaxis], roc=roc, concave=concave, aberrations=aberrations,
+                          mirror_radius=mirror_radius)
+    return np.mean(compute_roc(sag[mirror_extent], 11.5, concave=concave))
+
+
+def check_roc_recovery(pixel_counts=[64, 128, 256], sphere_tolerance=0.05, aberrated_tolerance=2.5):
+    # Mean ROC (mm) of processed synthetic measurements against the mean ROC of the noise-free sag
+    # they were generated from, over the same pixels (see expected_mean_roc). Noise-free spheres are
+    # recovered exactly; the aberrated surface shows the smoothing bias of about 1-2 mm.
+    with tempfile.TemporaryDirectory() as folder:
+        csv_file = os.path.join(folder, 'synthetic.csv')
+        print('ROC recovery (mm)')
+        print('%8s %8s %10s %12s %12s %10s' % ('layout', 'pixels', 'input', 'expected', 'recovered', 'error'))
+        cases = [(5275, True, None, 0, sphere_tolerance),
+                 (5300, False, None, 0, sphere_tolerance),
+                 (5275, True, ABERRATIONS, 0.0001, aberrated_tolerance)]
+        for roc, concave, aberrations, noise, tolerance in cases:
+            write_concentric_measurement(csv_file, roc=roc, concave=concave, aberrations=aberrations, noise=noise, seed=1)
+            for number_of_pixels in pixel_counts:
+                cropped_data, smoothed_data, mirror_extent = process_spherometer_concentric(
+                    csv_file, number_of_pixels=number_of_pixels, crop_clear_aperture=True)
+                x, y = concentric_axes(32, number_of_pixels)
+                expected = expected_mean_roc(x, y, mirror_extent, roc, concave, aberrations, mirror_radius=16)
+                recovered = np.nanmean(compute_roc(smoothed_data, 11.5, concave=concave))
+                print('%8s %8d %10.1f %12.2f %12.2f %10.2f' % ('polar', number_of_pixels, roc, expected, recovered,
+                                                               recovered - expected))
+                assert abs(recovered - expected) < tolerance, 'ROC %.2f recovered as %.2f' % (expected, recovered)
+
+            write_grid_measurement(csv_file, roc=roc, concave=concave, aberrations=aberrations, noise=noise, seed=1)
+            cropped_data, smoothed_data, mirror_extent = process_spherometer_grid(csv_file, smoothing='normalized')
+            # Grid maps live in tile space: 10 squares of 3", centered on square (5, 5)
+            x = (np.linspace(0, 10, smoothed_data.shape[1]) - 5) * 3
+            y = (np.linspace(0, 10, smoothed_data.shape[0]) - 5) * 3
+            expected = expected_mean_roc(x, y, mirror_extent, roc, concave, aberrations, mirror_radius=14)
+            recovered = np.nanmean(compute_roc(smoothed_data, 11.5, concave=concave))
+            print('%8s %8d %10.1f %12.2f %12.2f %10.2f' % ('grid', smoothed_data.shape[0], roc, expected, recovered,
+                                                           recovered - expected))
+            assert abs(recovered - expected) < tolerance, 'ROC %.2f recovered as %.2f' % (expected, recovered)
+
+
+def run_convergence_report(pixel_counts=[32, 64, 96, 128, 256, 512], reference_pixels=512, smoothing_sigma=0.88,
+                           repeats=3):
+    # Mean ROC (mm) per pixel count against a default (hard footprint, 7 pixel smoothing) run at
+    # reference_pixels, for every footprint mode with 7 pixel and smoothing_sigma (in) smoothing
+    with tempfile.TemporaryDirectory() as folder:
+        csv_file = os.path.join(folder, 'synthetic.csv')
+        write_concentric_measurement(csv_file, aberrations=ABERRATIONS, noise=0.0005, seed=0)
+
+        for crop_clear_aperture in [True, False]:
+            cropped_data, smoothed_data, mirror_extent = process_spherometer_concentric(
+                csv_file, number_of_pixels=reference_pixels, crop_clear_aperture=crop_clear_aperture)
+            reference = np.nanmean(compute_roc(smoothed_data, 11.5))
+
+            print('Mean ROC convergence (%s, reference %.3f mm at %d px)'
+                  % ('clear aperture' if crop_clear_aperture else 'full mirror', reference, reference_pixels))
+            print('%10s %10s %8s %12s %10s %10s' % ('footprint', 'smoothing', 'pixels', 'mean ROC', 'error', 'time (s)'))
+            for footprint in ['hard', 'area']:
+                for sigma in [None, smoothing_sigma]:
+                    for number_of_pixels in pixel_counts:
+                        seconds, (cropped_data, smoothed_data, mirror_extent) = time_call(
+                            process_spherometer_concentric, csv_file, repeats=repeats, number_of_pixels=number_of_pixels,
+                            crop_clear_aperture=crop_clear_aperture, footprint=footprint, smoothing_sigma=sigma)
+                        mean_roc = np.nanmean(compute_roc(smoothed_data, 11.5))
+                        print('%10s %10s %8d %12.3f %10.3f %10.4f' % (footprint, '7 px' if sigma is None else '%.2f in' % sigma,
+                                                                    number_of_pixels, mean_roc, mean_roc - reference, seconds))
+
+
+if __name__ == "__main__":
+    run_concentric_benchmark()
+    run_grid_benchmark()
+    run_stage_benchmark()
+    check_roc_recovery()
+    run_convergence_report()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Live spherometer measurement
+
+Builds the concentric sag map one reading at a time while a measurement session is in progress.
+Each reading only touches the pixels under its footprint; smoothing and ROC are recomputed
+lazily when they are asked for.
+"""
+
+import numpy as np
+
+from spherometer_utils import (concentric_axes, finish_concentric_map, footprint_stencil, compute_roc,
+                               check_sag_unit)
+
+
+class IncrementalConcentricMap:
+    #   Same parameters as process_spherometer_concentric, plus concave for the ROC calculation.
+    #   Readings are (ring, angle, sag): ring indexes measurement_radius, angle is in radians
+    #   counterclockwise from +x (the csv files start each ring at 0 and space readings evenly).
+
+    def __init__(self, measurement_radius=[11.875, 8.5, 5.25, 2], spherometer_diameter=11.5, object_diameter=32,
+                 number_of_pixels=256, crop_clear_aperture=False, sag_unit='in', concave=True):
+        check_sag_unit(sag_unit)
+
+        self.measurement_radius = list(measurement_radius)
+        self.spherometer_diameter = spherometer_diameter
+        self.object_diameter = object_diameter
+        self.crop_clear_aperture = crop_clear_aperture
+        self.sag_unit = sag_unit
+        self.concave = concave
+
+        self.x, self.y = concentric_axes(object_diameter, number_of_pixels)
+        self.sag_sum = np.zeros((self.y.size, self.x.size))
+        self.count = np.zeros((self.y.size, self.x.size), dtype=np.int64)
+        self.readings = []
+        self._maps = None
+        self._roc = None
+
+    def add_reading(self, ring, angle, sag):
+        radius = self.measurement_radius[ring]
+        x_pos = radius * np.cos(angle)
+        y_pos = radius * np.sin(angle)
+        mask, (row_start, row_stop, col_start, col_stop) = footprint_stencil(self.x, self.y, x_pos, y_pos,
+                                                                             self.spherometer_diameter / 2)
+
+        self.sag_sum[row_start:row_stop, col_start:col_stop][mask] += sag
+        self.count[row_start:row_stop, col_start:col_stop] += mask
+        self.readings.append((ring, angle, sag))
+        self._maps = None
+        self._roc = None
+
+    def add_readings(self, readings):
+        # Readings parsed by measurement_io; invalid cells are ignored
+        for reading in readings[readings['valid']]:
+            self.add_reading(int(reading['ring']), reading['angle'], reading['sag'])
+
+    def _update(self):
+        if self._maps is None:
+            average = np.full(self.sag_sum.shape, np.nan)
+            np.divide(self.sag_sum, self.count, out=average, where=self.count > 0)
+            self._maps = finish_concentric_map(average, self.x, self.y, self.object_diameter,
+                                               crop_clear_aperture=self.crop_clear_aperture, sag_unit=self.sag_unit,
+                                               copy=False)
+        return self._maps
+
+    def cropped(self):
+        return self._update()[0]
+
+    def smoothed(self):
+        return self._update()[1]
+
+    def mirror_extent(self):
+        return self._update()[2]
+
+    def roc(self):
+        if self._roc is None:
+            self._roc = compute_roc(self.smoothed(), self.spherometer_diameter, concave=self.concave)
+        return self._roc
+
+    def mean_roc(self):
+        return np.nanmean(self.roc())
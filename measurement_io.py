@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Reading spherometer measurement files
+
+Parses a measurement file once into a NumPy structured array of readings that the processors
+in spherometer_utils consume directly. Cells that cannot be read as a sag are reported back to
+the caller instead of being silently dropped.
+
+Concentric files hold one row per measurement radius, each with equally spaced readings around
+the ring. Grid files hold a single row of N x N readings. Blank and '0' cells are padding.
+"""
+
+import csv
+import os
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+
+# One record per reading. x, y are the footprint center in the units of measurement_radius
+# (concentric) or tiles (grid); valid is False for cells that could not be parsed as a sag.
+READING_DTYPE = np.dtype([('ring', np.int32),
+                          ('radius', np.float64),
+                          ('angle', np.float64),
+                          ('x', np.float64),
+                          ('y', np.float64),
+                          ('sag', np.float64),
+                          ('valid', np.bool_)])
+
+PADDING_CELLS = ('', '0')
+
+
+def _parse_cells(cells):
+    # Sag values and validity mask for a list of cell strings
+    sags = np.full(len(cells), np.nan)
+    valid = np.zeros(len(cells), dtype=bool)
+    for num, cell in enumerate(cells):
+        try:
+            sags[num] = float(cell)
+            valid[num] = True
+        except ValueError:
+            continue
+    return sags, valid
+
+
+def parse_concentric_rows(rows, measurement_radius):
+    #   rows: one list of cell strings per measurement radius
+    #   measurement_radius: radius of each ring, same units as the footprint coordinates
+    #   Returns (readings, skipped) where readings is a READING_DTYPE array and skipped lists
+    #   (row, column, text) for every non-padding cell that could not be parsed
+    ring_readings = []
+    skipped = []
+
+    for ring, cells in enumerate(rows):
+        columns = [column for column, cell in enumerate(cells) if cell not in PADDING_CELLS]
+        if not columns:
+            continue
+        if ring >= len(measurement_radius):
+            raise ValueError('Measurement has data in row ' + str(ring + 1) + ' but only '
+                             + str(len(measurement_radius)) + ' measurement radii were given')
+
+        sags, valid = _parse_cells([cells[column] for column in columns])
+        skipped.extend((ring, columns[num], cells[columns[num]]) for num in np.flatnonzero(~valid))
+
+        radius = measurement_radius[ring]
+        theta = np.linspace(0, 2 * np.pi, len(columns), endpoint=False)
+
+        readings = np.zeros(len(columns), dtype=READING_DTYPE)
+        readings['ring'] = ring
+        readings['radius'] = radius
+        readings['angle'] = theta
+        readings['x'] = radius * np.cos(theta)
+        readings['y'] = radius * np.sin(theta)
+        readings['sag'] = sags
+        readings['valid'] = valid
+        ring_readings.append(readings)
+
+    if not ring_readings:
+        return np.zeros(0, dtype=READING_DTYPE), skipped
+    return np.concatenate(ring_readings), skipped
+
+
+def parse_grid_row(cells, number_of_squares):
+    #   cells: a single row of N x N cell strings, row-major over the grid
+    #   Returns (readings, skipped) like parse_concentric_rows; ring is the grid row and x, y are in tiles
+    columns = [column for column, cell in enumerate(cells) if cell not in PADDING_CELLS]
+    sags, valid = _parse_cells([cells[column] for column in columns])
+    skipped = [(0, columns[num], cells[columns[num]]) for num in np.flatnonzero(~valid)]
+
+    columns = np.array(columns, dtype=int)
+    readings = np.zeros(columns.size, dtype=READING_DTYPE)
+    readings['ring'] = columns // number_of_squares
+    readings['radius'] = np.nan
+    readings['angle'] = np.nan
+    readings['x'] = columns % number_of_squares
+    readings['y'] = np.floor(columns / number_of_squares)
+    readings['sag'] = sags
+    readings['valid'] = valid
+    return readings, skipped
+
+
+def read_csv_rows(csv_file, encoding='utf-8-sig'):
+    with open(csv_file, mode='r', encoding=encoding) as file:
+        return list(csv.reader(file))
+
+
+def write_csv_rows(rows, csv_file):
+    with open(csv_file, 'w', newline='') as file:
+        csv.writer(file).writerows(rows)
+
+
+@contextmanager
+def atomic_write(path, mode='wb', encoding=None):
+    # Open a temporary file next to path and swap it in with os.replace once the block completes,
+    # so readers (and parallel writers) never see a partial file. On error the temporary file is removed
+    handle, temporary_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(handle, mode, encoding=encoding) as file:
+            yield file
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def read_concentric_csv(csv_file, measurement_radius, encoding='utf-8-sig'):
+    return parse_concentric_rows(read_csv_rows(csv_file, encoding=encoding), measurement_radius)
+
+
+def read_grid_csv(csv_file, number_of_squares, encoding='utf-8'):
+    rows = read_csv_rows(csv_file, encoding=encoding)
+    return parse_grid_row(rows[0] if rows else [], number_of_squares)
+
+
+def format_skipped(skipped):
+    # Human readable summary of skipped cells, e.g. for warnings
+    return ', '.join('row %d col %d (%r)' % (row + 1, column + 1, text) for row, column, text in skipped)
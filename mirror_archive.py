@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Per-mirror archive of processed spherometer sessions
+
+One folder per mirror (M6, M18, M19, ...) holding every measurement session:
+    index.json                  session metadata: date, source file, parameters, mean ROC, ...
+    sessions/<id>/readings.npy  raw readings (measurement_io.READING_DTYPE)
+    sessions/<id>/roc.npy       float32 ROC map (mm)
+    sessions/<id>/sag.npy       float32 smoothed sag map (in)
+
+Maps are opened memory-mapped, so time-series queries answered from the index never touch
+the maps, and maps that are read only page in the slices that are used.
+"""
+
+import json
+import os
+import warnings
+from datetime import datetime
+
+import numpy as np
+
+from measurement_io import atomic_write
+
+INDEX_FILE = 'index.json'
+MAP_DTYPE = np.float32
+
+
+def session_date(session_id):
+    # Session folders are named by date, e.g. 20250825
+    return datetime.strptime(session_id[:8], '%Y%m%d')
+
+
+class MirrorArchive:
+    def __init__(self, path):
+        self.path = path
+        self.index_path = os.path.join(path, INDEX_FILE)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as file:
+                self.index = json.load(file)
+        else:
+            self.index = {'mirror': os.path.basename(os.path.normpath(path)), 'sessions': {}}
+
+    def _session_folder(self, session_id):
+        return os.path.join(self.path, 'sessions', session_id)
+
+    def _write_index(self):
+        # Replace the index atomically so a reader never sees a partial file
+        os.makedirs(self.path, exist_ok=True)
+        with atomic_write(self.index_path, 'w', encoding='utf-8') as file:
+            json.dump(self.index, file, indent=1, sort_keys=True)
+
+    def _save_array(self, folder, kind, array):
+        # Written to a new file and swapped in, never truncated in place: readers that have the
+        # old map memory-mapped keep their (unlinked) copy instead of crashing with SIGBUS
+        with atomic_write(os.path.join(folder, kind + '.npy')) as file:
+            np.save(file, array)
+
+    def add_session(self, session_id, readings, params, roc, sag, source_file=None):
+        #   session_id: session name, starting with its date as YYYYMMDD (e.g. '20250825' or '20250825_pm')
+        #   readings: raw readings parsed by measurement_io
+        #   params: processing parameters used for roc and sag (json serializable)
+        #   roc, sag: maps as returned by the processors; stored as float32
+        folder = self._session_folder(session_id)
+        os.makedirs(folder, exist_ok=True)
+        self._save_array(folder, 'readings', readings)
+        self._save_array(folder, 'roc', np.asarray(roc, dtype=MAP_DTYPE))
+        self._save_array(folder, 'sag', np.asarray(sag, dtype=MAP_DTYPE))
+
+        valid = readings['sag'][readings['valid']]
+        self.index['sessions'][session_id] = {'date': session_date(session_id).strftime('%Y-%m-%d'),
+                                              'source_file': source_file,
+                                              'params': params,
+                                              'shape': list(np.shape(roc)),
+                                              'readings': int(valid.size),
+                                              'mean_sag': float(np.mean(valid)) if valid.size else None,
+                                              'mean_roc': float(np.nanmean(roc)),
+                                              'pv_roc': float(np.nanmax(roc) - np.nanmin(roc)),
+                                              'rms_roc': float(np.nanstd(roc))}
+        self._write_index()
+
+    def sessions(self, start=None, end=None):
+        # Session ids in date order, optionally limited to start <= date <= end (datetime or 'YYYY-MM-DD')
+        start = datetime.fromisoformat(start) if isinstance(start, str) else start
+        end = datetime.fromisoformat(end) if isinstance(end, str) else end
+        selected = []
+        for session_id in sorted(self.index['sessions']):
+            date = session_date(session_id)
+            if (start is None or date >= start) and (end is None or date <= end):
+                selected.append(session_id)
+        return selected
+
+    def metadata(self, session_id):
+        return self.index['sessions'][session_id]
+
+    def load_map(self, session_id, kind='roc'):
+        # kind: 'roc', 'sag' or 'readings'; maps are memory-mapped read-only (zero copy)
+        return np.load(os.path.join(self._session_folder(session_id), kind + '.npy'), mmap_mode='r')
+
+    def series(self, key='mean_roc', start=None, end=None):
+        # (dates, values) of an index field over time, e.g. the mean ROC over the last 3 weeks
+        session_ids = self.sessions(start, end)
+        dates = [session_date(session_id) for session_id in session_ids]
+        values = np.array([self.index['sessions'][session_id][key] for session_id in session_ids], dtype=float)
+        return dates, values
+
+    def stack(self, session_ids=None, kind='roc'):
+        # (N, H, W) array of the given sessions' maps; they must share a shape
+        session_ids = self.sessions() if session_ids is None else session_ids
+        return np.stack([self.load_map(session_id, kind) for session_id in session_ids])
+
+
+def archive_directory(mirror_folder, archive_path, config=None, workers=None):
+    # Process every <date>/*.csv below a mirror folder into an archive (see batch_processing)
+    from batch_processing import DEFAULT_CONFIG, process_directory
+    from measurement_io import read_concentric_csv
+
+    full_config = dict(DEFAULT_CONFIG)
+    if config:
+        full_config.update(config)
+    params = {key: value for key, value in full_config.items() if key != 'cache_dir'}
+
+    archive = MirrorArchive(archive_path)
+    results = process_directory(mirror_folder, full_config, workers=workers)
+    for result in results:
+        if result['error']:
+            continue
+        name = os.path.splitext(os.path.basename(result['file']))[0]
+        session_id = result['session'] + '_' + name
+        try:
+            session_date(session_id)
+        except ValueError:
+            warnings.warn('Skipping ' + result['file'] + ': session folder is not named by date (YYYYMMDD)')
+            continue
+        # The maps are stored as they come out of process_measurement_file (flipped for display)
+        readings, skipped = read_concentric_csv(result['file'], params['measurement_radius'])
+        archive.add_session(session_id, readings, params, result['roc'], result['sag'], source_file=result['file'])
+    return archive, results
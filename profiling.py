@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Stage-level profiling of the processing pipeline
+
+Pass a StageProfiler as `profiler=` to the processors and entry points to record the wall time
+(and optionally the tracemalloc allocation peak) of every stage, plus counts such as the number of
+readings, footprint pixels and NaN fraction. summary() / to_json() give one structured record per
+file, so batch runs can be profiled in aggregate.
+"""
+
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+
+class StageProfiler:
+    def __init__(self, label=None, trace_memory=False):
+        #   label: what is being profiled, e.g. the measurement file
+        #   trace_memory: also record the peak traced allocation of each stage (slower)
+        self.label = label
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.counts = {}
+        self._started_tracing = False
+
+    @contextmanager
+    def stage(self, name):
+        # Stages are meant to be sequential; memory peaks of nested stages are not separated
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = {'name': name, 'seconds': time.perf_counter() - start}
+            if self.trace_memory:
+                record['peak_bytes'] = max(tracemalloc.get_traced_memory()[1] - start_memory, 0)
+            self.stages.append(record)
+
+    def count(self, name, value):
+        self.counts[name] = value
+
+    def stop(self):
+        # Stop tracemalloc if this profiler started it
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def summary(self):
+        return {'label': self.label,
+                'total_seconds': sum(record['seconds'] for record in self.stages),
+                'stages': list(self.stages),
+                'counts': dict(self.counts)}
+
+    def to_json(self):
+        return json.dumps(self.summary(), default=float)
+
+
+def profile_stage(profiler, name):
+    # Context for an optional profiler: a no-op when profiler is None
+    return profiler.stage(name) if profiler is not None else nullcontext()
+
+
+def profile_count(profiler, name, value):
+    if profiler is not None:
+        profiler.count(name, value)
@@ -1,38 +1,46 @@
-import numpy as np
-import csv
 import os
+import re
 
-def convert_txt_to_csv(txt_path,csv_path=None,num_measurement_rings = 4):
-    val_holder = [[] for i in range(num_measurement_rings)]
+from measurement_io import parse_concentric_rows, write_csv_rows
+
+# Readings on a line are separated by '-'; a segment holds a reading if it has an inch mark,
+# and the reading is the text in front of the first mark
+READING_PATTERN = re.compile(r'(?:^|-)([^-"”]*)["”][^-]*')
 
-    file = open(txt_path,'r',encoding='utf-8')
-
-    while True:
-        line = file.readline()
-        if not line:
-            break
-        split_line = line.split('-')
-        for i in range(len(split_line)):
-            split_line[i] = split_line[i].replace('”','"')
-        bool_line = ['"' in segment for segment in split_line]
-        reduced_line = np.array(split_line)[np.array(bool_line)]
-
-        vals = [entry.split('"')[0] for entry in reduced_line]
-        print(vals)
-        for num,val in enumerate(vals):
+def iter_txt_lines(txt_path):
+    # Yields the readings on each line of an instrument TXT export, one per measurement ring
+    with open(txt_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            yield READING_PATTERN.findall(line)
+
+def txt_to_rows(txt_path, num_measurement_rings=4):
+    # One row of readings per measurement ring, the layout of the concentric csv files
+    val_holder = [[] for i in range(num_measurement_rings)]
+    for vals in iter_txt_lines(txt_path):
+        for num, val in enumerate(vals):
             val_holder[num].append(val)
-    file.close()
+    return val_holder
+
+def convert_txt_to_csv(txt_path,csv_path=None,num_measurement_rings = 4):
+    val_holder = txt_to_rows(txt_path, num_measurement_rings)
 
     if csv_path:
-        with open(csv_path,'w',newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerows(val_holder)
+        write_csv_rows(val_holder, csv_path)
     else:
         return val_holder
 
-path = 'C:/Users/warrenbfoster/OneDrive - University of Arizona/Documents/LFAST/mirrors/M6/'
+def read_concentric_txt(txt_path, measurement_radius, csv_path=None):
+    # Readings and skipped cells straight from a TXT export, see measurement_io.parse_concentric_rows
+    # If csv_path is given, the rows are also written out as a concentric csv
+    rows = txt_to_rows(txt_path, num_measurement_rings=len(measurement_radius))
+    if csv_path:
+        write_csv_rows(rows, csv_path)
+    return parse_concentric_rows(rows, measurement_radius)
+
+if __name__ == "__main__":
+    path = 'C:/Users/warrenbfoster/OneDrive - University of Arizona/Documents/LFAST/mirrors/M6/'
 
-for file in os.listdir(path):
-    if file.endswith('.txt'):
-        file_name = file.split('.')[0]
-        val_holder = convert_txt_to_csv(path + file, path + file_name + '.csv')
\ No newline at end of file
+    for file in os.listdir(path):
+        if file.endswith('.txt'):
+            file_name = file.split('.')[0]
+            convert_txt_to_csv(path + file, path + file_name + '.csv')
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of processed ROC maps
+
+Results are stored as .npz files named by a hash of the measurement file contents and every
+processing parameter, so a rerun over an unchanged archive loads maps instead of recomputing them.
+The cache folder is bounded in size; the least recently used results are evicted first.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from spherometer_utils import process_spherometer_concentric, compute_roc
+from profiling import profile_stage
+from measurement_io import atomic_write
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'spherometer_roc')
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+CACHE_VERSION = 1  # Bump when processing changes in a way that invalidates stored maps
+
+
+def cache_key(csv_file, params):
+    #   csv_file: measurement file path, or readings parsed by measurement_io
+    #   params: dict of every parameter that affects the result
+    digest = hashlib.sha256()
+    if isinstance(csv_file, np.ndarray):
+        digest.update(np.ascontiguousarray(csv_file).tobytes())
+    else:
+        with open(csv_file, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+    digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    digest.update(str(CACHE_VERSION).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def load_cached_result(key, cache_dir=DEFAULT_CACHE_DIR, names=()):
+    # Dict of stored arrays, or None on a cache miss
+    #   names: arrays the result must hold; an entry missing any of them is a miss
+    # Any failure to read the entry (missing, evicted by another worker, empty, truncated or corrupt)
+    # is a miss, so a bad entry is recomputed and overwritten instead of failing the caller
+    path = os.path.join(cache_dir, key + '.npz')
+    try:
+        with np.load(path) as stored:
+            result = {name: stored[name] for name in stored.files}
+    except Exception:
+        return None
+    if not all(name in result for name in names):
+        return None
+    try:
+        os.utime(path)  # Mark as recently used for eviction
+    except OSError:
+        pass
+    return result
+
+
+def store_result(key, result, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    # Written to a temporary file first so parallel workers never see a partial result
+    os.makedirs(cache_dir, exist_ok=True)
+    with atomic_write(os.path.join(cache_dir, key + '.npz')) as file:
+        np.savez(file, **result)
+    evict(cache_dir, max_bytes)
+
+
+def evict(cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    # Delete least recently used results until the cache fits in max_bytes
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.npz'):
+            try:
+                stat = os.stat(os.path.join(cache_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            continue
+        total -= size
+
+
+def cached_process_concentric(csv_file, measurement_radius=[11.875, 8.5, 5.25, 2], spherometer_diameter=11.5,
+                              object_diameter=32, number_of_pixels=256, crop_clear_aperture=False, sag_unit='in',
+                              concave=True, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, profiler=None,
+                              dtype=np.float64, footprint='hard', smoothing_sigma=None):
+    # process_spherometer_concentric followed by compute_roc, served from the cache when possible
+    # Returns cropped_data, smoothed_data, roc (roc is not flipped)
+    # profiler: optional profiling.StageProfiler; a hit records only the 'cache_lookup' stage
+    params = {'measurement_radius': [float(radius) for radius in measurement_radius],
+              'spherometer_diameter': float(spherometer_diameter),
+              'object_diameter': float(object_diameter),
+              'number_of_pixels': int(number_of_pixels),
+              'crop_clear_aperture': bool(crop_clear_aperture),
+              'sag_unit': sag_unit,
+              'concave': bool(concave),
+              'dtype': np.dtype(dtype).name,
+              'footprint': footprint,
+              'smoothing_sigma': None if smoothing_sigma is None else float(smoothing_sigma)}
+    with profile_stage(profiler, 'cache_lookup'):
+        key = cache_key(csv_file, params)
+        result = load_cached_result(key, cache_dir, names=('cropped_data', 'smoothed_data', 'roc'))
+    if result is not None:
+        return result['cropped_data'], result['smoothed_data'], result['roc']
+
+    cropped_data, smoothed_data, mirror_extent = process_spherometer_concentric(
+        csv_file,
+        measurement_radius=measurement_radius,
+        spherometer_diameter=spherometer_diameter,
+        object_diameter=object_diameter,
+        number_of_pixels=number_of_pixels,
+        crop_clear_aperture=crop_clear_aperture,
+        sag_unit=sag_unit,
+        profiler=profiler,
+        dtype=dtype,
+        footprint=footprint,
+        smoothing_sigma=smoothing_sigma)
+
+    with profile_stage(profiler, 'roc'):
+        roc = compute_roc(smoothed_data, spherometer_diameter, concave=concave)
+    with profile_stage(profiler, 'cache_store'):
+        store_result(key, {'cropped_data': cropped_data, 'smoothed_data': smoothed_data, 'roc': roc},
+                     cache_dir, max_bytes)
+    return cropped_data, smoothed_data, roc
@@ -1,29 +1,41 @@
 import os
 import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import filedialog, ttk, messagebox
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 from matplotlib.figure import Figure
 import numpy as np
-from LFAST_wavefront_utils import process_spherometer_concentric
-
-def polar_roc_measurement(csv_file, spherometer_diameter, object_diameter,
-                          measurement_radius, number_of_pixels,
-                          crop_clear_aperture, concave, sag_unit):
-    cropped_data, smoothed_data, mirror_extent = process_spherometer_concentric(
-        csv_file,
-        measurement_radius=measurement_radius,
-        spherometer_diameter=spherometer_diameter,
-        object_diameter=object_diameter,
-        number_of_pixels=number_of_pixels,
-        crop_clear_aperture=crop_clear_aperture,
-        sag_unit=sag_unit)
+from spherometer_utils import (concentric_axes, accumulate_footprints, finish_concentric_map, check_sag_unit,
+                               compute_roc)
+from measurement_io import read_csv_rows, parse_concentric_rows, format_skipped
+
+PREVIEW_PIXELS = 64  # Resolution of the quick preview drawn before the full resolution map
+REFINE_POLL_MS = 100  # How often the Tk loop checks for a finished refinement
+
+class RefinementCancelled(Exception):
+    pass
 
-    roc = 25.4 * (
-        (spherometer_diameter ** 2 / 4 + smoothed_data ** 2) /
-        (2 * np.abs(smoothed_data)) +
-        (0.25 / 2 if concave else -0.25 / 2)
-    )
-    return np.flip(roc, 0), np.flip(smoothed_data, 0)
+def process_smoothed(readings, spherometer_diameter, object_diameter, number_of_pixels,
+                     crop_clear_aperture, sag_unit, is_stale=None):
+    # Smoothed sag map (flipped for display); the only expensive step, run off the Tk thread.
+    # Same steps as process_spherometer_concentric, with is_stale (optional callable) checked between
+    # them so a refinement nobody will draw raises RefinementCancelled instead of running to the end
+    def check_stale():
+        if is_stale is not None and is_stale():
+            raise RefinementCancelled()
+
+    check_sag_unit(sag_unit)
+    readings = readings[readings['valid']]
+    x, y = concentric_axes(object_diameter, number_of_pixels)
+    check_stale()
+    avg_data = accumulate_footprints(x, y, readings['x'], readings['y'], readings['sag'], spherometer_diameter / 2)
+    check_stale()
+    cropped_data, smoothed_data, mirror_extent = finish_concentric_map(
+        np.reshape(avg_data, (y.size, x.size)), x, y, object_diameter,
+        crop_clear_aperture=crop_clear_aperture,
+        sag_unit=sag_unit,
+        copy=False)
+    return np.flip(smoothed_data, 0)
 
 class RocGui(tk.Tk):
     def __init__(self):
@@ -32,9 +44,26 @@ class RocGui(tk.Tk):
         self.geometry("800x600")
 
         self.loaded_path = None
+        self.rows = None
         self.roc = None
         self.smoothed = None
 
+        # Smoothed maps of the loaded file, keyed by (radii, sphero diam, obj diam, crop, pixels).
+        # Shape only changes the ROC formula, so it is applied on top of the memoized map.
+        self.memo = {}
+        # Readings (and skipped cells) parsed from the loaded rows, keyed by the radii tuple
+        self.parsed = {}
+        # Memo key currently drawn, so a shape change can redraw it without recomputing
+        self.shown_key = None
+        self.shown_preview = False
+
+        # Full resolution maps are computed off the Tk thread; bumping generation marks any
+        # refinement still in flight as stale, and a stale refinement stops at its next stage
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.refinement = None
+        self.generation = 0
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
         self.ctrl = ttk.Frame(self)
         self.ctrl.pack(side=tk.TOP, fill=tk.X, pady=5)
 
@@ -71,16 +100,44 @@ class RocGui(tk.Tk):
         for ent, val in zip(self.rad_entries, ["11.875", "8.5", "5.25", "2", ""]):
             ent.insert(0, val)
 
+        self.status = ttk.Label(self.ctrl, text="")
+        self.status.grid(row=1, column=4, columnspan=5, sticky='w')
+        # Kept apart from status, which refinement progress overwrites
+        self.skipped_label = ttk.Label(self.ctrl, text="", foreground="red")
+        self.skipped_label.grid(row=2, column=0, columnspan=11, sticky='w')
+        self.progress = ttk.Progressbar(self.ctrl, mode="indeterminate", length=80)
+        self.progress.grid(row=1, column=9, columnspan=2, padx=5)
+
+        # Any parameter change that enters the memo key makes a pending refinement stale.
+        # Shape only changes the ROC formula: it redraws the current map and lets a refinement finish.
+        for var in (self.var_sphero, self.var_obj, self.var_pix, self.var_crop):
+            var.trace_add("write", lambda *args: self.cancel_refinement())
+        self.var_shape.trace_add("write", lambda *args: self.redraw_shape())
+        for ent in self.rad_entries:
+            ent.bind("<KeyRelease>", lambda event: self.cancel_refinement())
+
         self.frame_plot = ttk.Frame(self)
         self.frame_plot.pack(fill=tk.BOTH, expand=True)
         self.canvas = None
         self.toolbar = None
+        self.fig = None
+        self.ax = None
+        self.image = None
+        self.colorbar = None
+        self.contours = None
 
 
     def load_csv(self):
         path = filedialog.askopenfilename(filetypes=[("CSV", "*.csv")])
         if path:
+            # Parsed once here; every plot reuses the rows and the memoized maps
             self.loaded_path = path
+            self.rows = read_csv_rows(path)
+            self.memo = {}
+            self.parsed = {}
+            self.shown_key = None
+            self.cancel_refinement()
+            self.skipped_label.config(text="")
             ttk.Label(self.ctrl, text=f"Loaded: {os.path.basename(path)}", foreground="blue")\
                 .grid(row=1, column=0, columnspan=4, sticky='w')
 
@@ -103,42 +160,124 @@ class RocGui(tk.Tk):
             messagebox.showerror("Invalid input", "Enter between 1 and 5 radii.")
             return
 
-        roc, smoothed = polar_roc_measurement(
-            csv_file=self.loaded_path,
+        if tuple(rads) not in self.parsed:
+            try:
+                self.parsed[tuple(rads)] = parse_concentric_rows(self.rows, rads)
+            except ValueError as err:
+                messagebox.showerror("Invalid input", str(err))
+                return
+        readings, skipped = self.parsed[tuple(rads)]
+
+        params = dict(
             spherometer_diameter=self.var_sphero.get(),
             object_diameter=self.var_obj.get(),
-            measurement_radius=rads,
-            number_of_pixels=self.var_pix.get(),
             crop_clear_aperture=self.var_crop.get(),
-            concave=(self.var_shape.get() == "Concave"),
             sag_unit='mm'
         )
+        key = (tuple(rads), params['spherometer_diameter'], params['object_diameter'], params['crop_clear_aperture'])
+        number_of_pixels = self.var_pix.get()
 
-        self.roc, self.smoothed = roc, smoothed
-        self.show_plot()
+        self.cancel_refinement()
+        generation = self.generation
+        self.skipped_label.config(text=f"Skipped unreadable cells: {format_skipped(skipped)}" if skipped else "")
 
-    def show_plot(self):
-        if self.canvas:
-            self.canvas.get_tk_widget().destroy()
+        if key + (number_of_pixels,) in self.memo:
+            self.show_memoized(key + (number_of_pixels,))
+            return
 
+        # Draw a coarse preview right away, then refine in the background
+        preview_pixels = min(PREVIEW_PIXELS, number_of_pixels)
+        if key + (preview_pixels,) not in self.memo:
+            self.memo[key + (preview_pixels,)] = process_smoothed(readings, number_of_pixels=preview_pixels, **params)
+        self.show_memoized(key + (preview_pixels,), preview=preview_pixels < number_of_pixels)
 
-        fig = Figure(figsize=(5, 5), dpi=100)
-        ax = fig.add_subplot(111)
-        im = ax.imshow(self.roc, cmap='viridis_r')
-        fig.colorbar(im, ax=ax, label='ROC (mm)')
-        fig.suptitle('Surface has mean ROC=' + str(int(np.nanmean(self.roc)))+ 'mm')
-        cs = ax.contour(self.roc, colors='k', levels=6, alpha=0.35)
-        ax.set_xticks([]);
-        ax.set_yticks([])
-        ax.set_xlabel(str(int(np.mean(np.diff(cs.levels)))) + 'mm contours')
+        if preview_pixels < number_of_pixels:
+            self.status.config(text=f"Refining to {number_of_pixels} px...")
+            self.progress.start(10)
+            self.refinement = self.executor.submit(process_smoothed, readings, number_of_pixels=number_of_pixels,
+                                                   is_stale=lambda: self.generation != generation, **params)
+            self.after(REFINE_POLL_MS, self.check_refinement, self.refinement, key + (number_of_pixels,), generation)
 
-        self.canvas = FigureCanvasTkAgg(fig, master=self.frame_plot)
-        self.canvas.draw()
-        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+    def cancel_refinement(self):
+        self.generation += 1
+        if self.refinement is not None:
+            if not self.refinement.cancel() and not self.refinement.done():
+                # Already running: it gives up at its next stale check, and the next refinement gets a
+                # fresh worker instead of queueing behind it
+                self.executor.shutdown(wait=False)
+                self.executor = ThreadPoolExecutor(max_workers=1)
+            self.refinement = None
+            self.progress.stop()
+            self.status.config(text="")
 
-        if self.toolbar is None:
+    def check_refinement(self, future, key, generation):
+        if future.cancelled():
+            return
+        if not future.done():
+            self.after(REFINE_POLL_MS, self.check_refinement, future, key, generation)
+            return
+
+        try:
+            self.memo[key] = future.result()
+        except Exception as err:
+            if generation == self.generation:
+                self.refinement = None
+                self.progress.stop()
+                self.status.config(text="")
+                messagebox.showerror("Processing failed", str(err))
+            return
+
+        # A stale refinement that finished before noticing still fills the memo, it just isn't drawn
+        if generation == self.generation:
+            self.refinement = None
+            self.progress.stop()
+            self.status.config(text="")
+            self.show_memoized(key)
+
+    def redraw_shape(self):
+        # Concave/convex only changes the ROC formula, so the drawn map is reused as is
+        if self.shown_key in self.memo:
+            self.show_memoized(self.shown_key, preview=self.shown_preview)
+
+    def show_memoized(self, key, preview=False):
+        self.shown_key = key
+        self.shown_preview = preview
+        self.smoothed = self.memo[key]
+        self.roc = compute_roc(self.smoothed, key[1], concave=(self.var_shape.get() == "Concave"))
+        self.show_plot(preview=preview)
+
+    def on_close(self):
+        self.cancel_refinement()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.destroy()
+
+    def show_plot(self, preview=False):
+        if self.canvas is None:
+            self.fig = Figure(figsize=(5, 5), dpi=100)
+            self.ax = self.fig.add_subplot(111)
+            self.image = self.ax.imshow(self.roc, cmap='viridis_r')
+            self.colorbar = self.fig.colorbar(self.image, ax=self.ax, label='ROC (mm)')
+            self.ax.set_xticks([]);
+            self.ax.set_yticks([])
+
+            self.canvas = FigureCanvasTkAgg(self.fig, master=self.frame_plot)
+            self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
             self.toolbar = NavigationToolbar2Tk(self.canvas, self.frame_plot)
             self.toolbar.update()
+        else:
+            # Update the existing image and colorbar in place
+            self.image.set_data(self.roc)
+            self.image.set_extent((-0.5, self.roc.shape[1] - 0.5, self.roc.shape[0] - 0.5, -0.5))
+            self.image.set_clim(np.nanmin(self.roc), np.nanmax(self.roc))
+            self.colorbar.update_normal(self.image)
+
+        if self.contours is not None:
+            self.contours.remove()
+        self.contours = self.ax.contour(self.roc, colors='k', levels=6, alpha=0.35)
+        self.ax.set_xlabel(str(int(np.mean(np.diff(self.contours.levels)))) + 'mm contours')
+        self.fig.suptitle('Surface has mean ROC=' + str(int(np.nanmean(self.roc)))+ 'mm' + (' (preview)' if preview else ''))
+
+        self.canvas.draw_idle()
 
 
 #%%
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Figure rendering for ROC and sag maps
+
+Draws on a bare matplotlib Figure with the Agg canvas, so it works without a display and
+is safe to call from worker processes. matplotlib is only imported when a figure is drawn.
+"""
+
+import numpy as np
+
+
+def import_matplotlib():
+    # The matplotlib classes used for rendering, imported on first use (callers may time this separately)
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    return Figure, FigureCanvasAgg
+
+
+def render_map_png(png_path, data, contour_data, title, colorbar_label, cmap='viridis_r'):
+    #   data, contour_data: maps already flipped for display (row 0 at the top)
+    Figure, FigureCanvasAgg = import_matplotlib()
+
+    fig = Figure(figsize=(6, 5), dpi=100)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    image = ax.imshow(data, cmap=cmap)
+    fig.colorbar(image, ax=ax, label=colorbar_label)
+    if np.any(np.isfinite(contour_data)):
+        ax.contour(contour_data, colors='k', alpha=0.35, levels=6)
+    ax.set_title(title)
+    ax.set_xticks([])
+    ax.set_yticks([])
+    fig.tight_layout()
+    fig.savefig(png_path)
+
+
+def render_roc_png(png_path, roc, smoothed_data, title, plot_label='Radius of curvature (mm)'):
+    # Same layout as polar_roc_measurement's ROC plot
+    render_map_png(png_path, roc, smoothed_data, title + ' has mean ROC=' + str(int(np.nanmean(roc))) + 'mm',
+                   plot_label)
+
+
+def render_sag_png(png_path, smoothed_data, title, spherometer_diameter):
+    render_map_png(png_path, smoothed_data, smoothed_data, title + ' sag',
+                   'Sag on ' + str(spherometer_diameter) + '" spherometer (in)')
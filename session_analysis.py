@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Comparing spherometer sessions of one mirror
+
+Processes N measurement sessions on one shared grid (and shared footprint stencils) into stacked
+(N, H, W) arrays, and derives polishing progress products from the whole stack at once:
+session-to-session differences, mean ROC per measurement ring and material removal estimates.
+Maps are in processing orientation (not flipped for display); use np.flip(stack, 1) to plot.
+"""
+
+import numpy as np
+
+from spherometer_utils import (concentric_axes, accumulate_footprints, finish_concentric_map, compute_roc,
+                               load_readings, check_sag_unit)
+from measurement_io import read_concentric_csv
+
+
+def process_sessions(measurement_files, measurement_radius=[11.875, 8.5, 5.25, 2], spherometer_diameter=11.5,
+                     object_diameter=32, number_of_pixels=256, crop_clear_aperture=False, sag_unit='in',
+                     concave=True, dtype=np.float64, footprint='hard', smoothing_sigma=None):
+    #   measurement_files: csv paths (or parsed readings) in session order, e.g. sorted by date
+    #   dtype: dtype of the stacked maps; np.float32 halves the stack for long series or large maps
+    #   footprint, smoothing_sigma: see spherometer_utils.process_spherometer_concentric
+    #   Returns a dict of stacked maps 'sag' (in) and 'roc' (mm), each (N, H, W), plus the shared
+    #   pixel coordinates 'x', 'y' (in) and the 'mirror_extent' mask
+    check_sag_unit(sag_unit)
+
+    x, y = concentric_axes(object_diameter, number_of_pixels)
+    sag = np.empty((len(measurement_files), y.size, x.size), dtype=dtype)
+    roc = np.empty_like(sag)
+    mirror_extent = None
+
+    for num, csv_file in enumerate(measurement_files):
+        readings = load_readings(csv_file, read_concentric_csv, measurement_radius)
+        readings = readings[readings['valid']]
+        avg_data = accumulate_footprints(x, y, readings['x'], readings['y'], readings['sag'], spherometer_diameter / 2,
+                                         dtype=dtype, footprint=footprint)
+        cropped_data, sag[num], mirror_extent = finish_concentric_map(np.reshape(avg_data, (y.size, x.size)), x, y,
+                                                                      object_diameter,
+                                                                      crop_clear_aperture=crop_clear_aperture,
+                                                                      sag_unit=sag_unit, copy=False,
+                                                                      smoothing_sigma=smoothing_sigma)
+        # Written straight into the stack, so the only temporary is one session's map
+        compute_roc(sag[num], spherometer_diameter, concave=concave, out=roc[num])
+
+    return {'sag': sag,
+            'roc': roc,
+            'x': x,
+            'y': y,
+            'mirror_extent': mirror_extent}
+
+
+def difference_maps(stack, reference=None):
+    # Session-to-session differences (N-1, H, W), or every session minus session `reference` (N, H, W)
+    if reference is None:
+        return np.diff(stack, axis=0)
+    return stack - stack[reference]
+
+
+def ring_mean_roc(roc_stack, x, y, ring_edges):
+    #   ring_edges: increasing radii (same units as x, y) bounding the rings, e.g. [2, 6, 10, 15]
+    #   Returns (N, len(ring_edges) - 1) mean ROC of every ring in every session, NaN for empty rings
+    radius = np.hypot(x[np.newaxis, :], y[:, np.newaxis])
+    ring = np.digitize(radius, ring_edges) - 1
+    number_of_rings = len(ring_edges) - 1
+
+    valid = np.isfinite(roc_stack) & (ring >= 0) & (ring < number_of_rings)
+    session = np.broadcast_to(np.arange(roc_stack.shape[0])[:, np.newaxis, np.newaxis], roc_stack.shape)
+    label = (session * number_of_rings + ring)[valid]
+
+    size = roc_stack.shape[0] * number_of_rings
+    sums = np.bincount(label, weights=roc_stack[valid], minlength=size)
+    counts = np.bincount(label, minlength=size)
+
+    means = np.full(size, np.nan)
+    np.divide(sums, counts, out=means, where=counts > 0)
+    return means.reshape(roc_stack.shape[0], number_of_rings)
+
+
+def material_removal(roc_stack, x, y, reference=0):
+    # Estimated surface height removed (mm) relative to session `reference`, per session and pixel.
+    # A sphere of radius R stands r^2 / 2R above its vertex, so a local ROC change from R0 to R moves
+    # the surface at radius r by r^2 / 2 * (1/R0 - 1/R). The estimate is relative to the mirror center
+    # and assumes the ROC change is gradual across the aperture.
+    radius_squared = np.power(25.4 * x[np.newaxis, :], 2) + np.power(25.4 * y[:, np.newaxis], 2)
+    curvature = 1 / roc_stack
+    return radius_squared / 2 * (curvature[reference] - curvature)
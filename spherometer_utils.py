@@ -1,13 +1,329 @@
 import numpy as np
-import csv
-from scipy import ndimage
+import threading
+import warnings
+from collections import OrderedDict
+from functools import wraps
+
+from measurement_io import read_concentric_csv, read_grid_csv, format_skipped
+from read_spherometer_txt import read_concentric_txt
+from surface_fit import fit_zernike, evaluate_zernike
+from profiling import profile_stage, profile_count
+
+STENCIL_CACHE_BYTES = 256 * 1024 ** 2  # Memory budget of each footprint stencil cache (hard masks, area weights)
+STENCIL_DECIMALS = 12  # Footprint centers are quantized to this many decimals when looking up a stencil
+SAG_UNITS = ['in', 'mm']  # Units sag readings can be given in
+FOOTPRINT_SUPERSAMPLING = 8  # Samples per pixel along each axis when estimating footprint area weights
+
+#%% Footprint accumulation
+
+def _stencil_cache(max_bytes):
+    # Least recently used cache of (array, window) stencils, bounded by the bytes of the cached arrays
+    # rather than their number: one 2048 px stencil weighs as much as a thousand 64 px ones
+    def decorator(function):
+        entries = OrderedDict()
+        total_bytes = [0]
+        lock = threading.Lock()  # The GUI computes maps on a worker thread
+
+        @wraps(function)
+        def cached(*key):
+            with lock:
+                if key in entries:
+                    entries.move_to_end(key)
+                    return entries[key]
+            result = function(*key)
+            with lock:
+                if key not in entries:
+                    entries[key] = result
+                    total_bytes[0] += result[0].nbytes
+                    while total_bytes[0] > max_bytes and len(entries) > 1:
+                        evicted_key, evicted = entries.popitem(last=False)
+                        total_bytes[0] -= evicted[0].nbytes
+            return result
+
+        def cache_clear():
+            with lock:
+                entries.clear()
+                total_bytes[0] = 0
+
+        def cache_bytes():
+            return total_bytes[0]
+
+        cached.cache_clear = cache_clear
+        cached.cache_bytes = cache_bytes
+        return cached
+    return decorator
+
+
+def _footprint_window(axis, center, radius):
+    # Index range along a sorted axis that can fall inside a footprint, padded by a pixel on each side
+    start = max(int(np.searchsorted(axis, center - radius)) - 1, 0)
+    stop = min(int(np.searchsorted(axis, center + radius)) + 1, axis.size)
+    return start, stop
+
+
+def _mean_by_pixel(pixel_index, values, size):
+    # Per-pixel mean of the values that landed on it, NaN where nothing landed.
+    # Values are grouped by pixel in reading order and reduced in one np.mean per footprint count,
+    # so the summation order (and the result) is identical to np.mean over a per-pixel list.
+    counts = np.bincount(pixel_index, minlength=size)
+    ordered = values[np.argsort(pixel_index, kind='stable')]
+    starts = np.cumsum(counts) - counts
+
+    avg_data = np.full(size, np.nan, dtype=values.dtype)
+    for count in np.unique(counts[counts > 0]):
+        pixels = np.flatnonzero(counts == count)
+        avg_data[pixels] = ordered[starts[pixels, np.newaxis] + np.arange(count)].mean(axis=1)
+    return avg_data
+
+
+@_stencil_cache(STENCIL_CACHE_BYTES)
+def _cached_footprint_stencil(x_start, x_stop, x_size, y_start, y_stop, y_size, x_pos, y_pos, spher_radius):
+    x = np.linspace(x_start, x_stop, x_size)
+    y = np.linspace(y_start, y_stop, y_size)
+
+    row_start, row_stop = _footprint_window(y, y_pos, spher_radius)
+    col_start, col_stop = _footprint_window(x, x_pos, spher_radius)
+
+    distance_from_center = np.sqrt(np.power(x[np.newaxis, col_start:col_stop] - x_pos, 2) +
+                                   np.power(y[row_start:row_stop, np.newaxis] - y_pos, 2))
+    mask = distance_from_center < spher_radius
+    mask.setflags(write=False)
+    return mask, (row_start, row_stop, col_start, col_stop)
+
+
+def footprint_stencil(x, y, x_pos, y_pos, spher_radius):
+    # Footprint mask of a reading centered at (x_pos, y_pos) and its placement window in the map
+    #   x, y: evenly spaced pixel coordinates along each axis of the map (as built by np.linspace)
+    #   Returns (mask, (row_start, row_stop, col_start, col_stop)); the mask is shared and read-only
+    #   Stencils are cached on the map geometry and quantized footprint center, so repeated reading
+    #   positions (every file measured with the same rings) reuse them instead of recomputing distances
+    return _cached_footprint_stencil(float(x[0]), float(x[-1]), x.size, float(y[0]), float(y[-1]), y.size,
+                                     round(float(x_pos), STENCIL_DECIMALS), round(float(y_pos), STENCIL_DECIMALS),
+                                     float(spher_radius))
+
+
+@_stencil_cache(STENCIL_CACHE_BYTES)
+def _cached_area_stencil(x_start, x_stop, x_size, y_start, y_stop, y_size, x_pos, y_pos, spher_radius):
+    x = np.linspace(x_start, x_stop, x_size)
+    y = np.linspace(y_start, y_stop, y_size)
+
+    row_start, row_stop = _footprint_window(y, y_pos, spher_radius)
+    col_start, col_stop = _footprint_window(x, x_pos, spher_radius)
+
+    # Number of samples, out of FOOTPRINT_SUPERSAMPLING x FOOTPRINT_SUPERSAMPLING per pixel (a cell of
+    # one pixel pitch around its center), that fall inside the footprint. Cells entirely inside or
+    # outside the circle are all or none; only cells the edge crosses are sampled. Counts are stored
+    # as small integers (uint8 for 8 x 8 samples), 8x smaller than float64 weights.
+    samples = FOOTPRINT_SUPERSAMPLING ** 2
+    x_step = (x_stop - x_start) / max(x_size - 1, 1)
+    y_step = (y_stop - y_start) / max(y_size - 1, 1)
+    half_diagonal = np.hypot(x_step, y_step) / 2
+    distance_from_center = np.sqrt(np.power(x[np.newaxis, col_start:col_stop] - x_pos, 2) +
+                                   np.power(y[row_start:row_stop, np.newaxis] - y_pos, 2))
+    counts = np.where(distance_from_center + half_diagonal < spher_radius, samples, 0).astype(np.min_scalar_type(samples))
+
+    rows, cols = np.nonzero(np.abs(distance_from_center - spher_radius) <= half_diagonal)
+    offsets = (np.arange(FOOTPRINT_SUPERSAMPLING) + 0.5) / FOOTPRINT_SUPERSAMPLING - 0.5
+    sample_x = x[col_start + cols, np.newaxis, np.newaxis] + offsets[np.newaxis, :] * x_step
+    sample_y = y[row_start + rows, np.newaxis, np.newaxis] + offsets[:, np.newaxis] * y_step
+    inside = np.power(sample_x - x_pos, 2) + np.power(sample_y - y_pos, 2) < spher_radius ** 2
+    counts[rows, cols] = np.count_nonzero(inside, axis=(1, 2))
+    counts.setflags(write=False)
+    return counts, (row_start, row_stop, col_start, col_stop)
+
+
+def _footprint_sample_counts(x, y, x_pos, y_pos, spher_radius):
+    return _cached_area_stencil(float(x[0]), float(x[-1]), x.size, float(y[0]), float(y[-1]), y.size,
+                                round(float(x_pos), STENCIL_DECIMALS), round(float(y_pos), STENCIL_DECIMALS),
+                                float(spher_radius))
+
+
+def footprint_area_weights(x, y, x_pos, y_pos, spher_radius):
+    # Anti-aliased counterpart of footprint_stencil: the fraction (0 to 1) of every pixel in the
+    # window that the footprint covers, instead of a mask of the pixel centers inside it.
+    #   Returns (weights, (row_start, row_stop, col_start, col_stop)); weights are a new float array
+    counts, window = _footprint_sample_counts(x, y, x_pos, y_pos, spher_radius)
+    return counts / FOOTPRINT_SUPERSAMPLING ** 2, window
+
+
+def _accumulate_area_weighted(x, y, x_positions, y_positions, sags, spher_radius, profiler=None, dtype=np.float64):
+    # Per-pixel mean of the readings weighted by the area each footprint covers (see accumulate_footprints)
+    # Sample counts are used as weights directly: the mean does not change with their common scale
+    dtype = np.dtype(dtype)
+    weighted_sum = np.zeros((y.size, x.size), dtype=dtype)
+    total_weight = np.zeros((y.size, x.size), dtype=dtype)
+    footprint_pixels = 0
+
+    with profile_stage(profiler, 'footprints'):
+        for x_pos, y_pos, sag in zip(x_positions, y_positions, sags):
+            counts, (row_start, row_stop, col_start, col_stop) = _footprint_sample_counts(x, y, x_pos, y_pos,
+                                                                                          spher_radius)
+            weighted_sum[row_start:row_stop, col_start:col_stop] += counts * dtype.type(sag)
+            total_weight[row_start:row_stop, col_start:col_stop] += counts
+            footprint_pixels += np.count_nonzero(counts)
+
+    profile_count(profiler, 'footprint_pixels', int(footprint_pixels))
+    with profile_stage(profiler, 'average'):
+        avg_data = np.full(x.size * y.size, np.nan, dtype=dtype)
+        np.divide(weighted_sum.ravel(), total_weight.ravel(), out=avg_data, where=total_weight.ravel() > 0)
+    return avg_data
+
+
+def clear_stencil_caches():
+    # Drop every cached footprint stencil and area weight map, e.g. to time a cold start
+    _cached_footprint_stencil.cache_clear()
+    _cached_area_stencil.cache_clear()
+
+
+def accumulate_footprints(x, y, x_positions, y_positions, sags, spher_radius, profiler=None, dtype=np.float64,
+                          footprint='hard'):
+    # Average every sag reading over the pixels its spherometer footprint covers
+    #   x, y: evenly spaced pixel coordinates along each axis of the map
+    #   x_positions, y_positions, sags: footprint center and measured sag for each reading
+    #   profiler: optional profiling.StageProfiler, records the 'footprints' and 'average' stages
+    #   dtype: dtype of the returned map and of the per-pixel values it is averaged from
+    #   footprint: 'hard' counts the pixels whose center lies inside the footprint, 'area' weights
+    #   every pixel by the share of it the footprint covers, which makes the map (and its mean ROC)
+    #   far less sensitive to the number of pixels
+    #   Returns a flat array of size len(y) * len(x), NaN where no footprint landed
+    if footprint == 'area':
+        return _accumulate_area_weighted(x, y, x_positions, y_positions, sags, spher_radius, profiler=profiler,
+                                         dtype=dtype)
+    elif footprint != 'hard':
+        raise ValueError('Footprint ' + footprint + ' not recognized!')
+
+    size = x.size * y.size
+
+    with profile_stage(profiler, 'footprints'):
+        stencils = [footprint_stencil(x, y, x_pos, y_pos, spher_radius) for x_pos, y_pos in zip(x_positions, y_positions)]
+        hits = [np.count_nonzero(mask) for mask, window in stencils]
+
+        # Every hit is written straight into buffers of the final size, instead of concatenating
+        # per-reading pieces, so the peak is one int32 index and one value per footprint pixel
+        pixel_index = np.empty(sum(hits), dtype=np.int32 if size < 2 ** 31 else np.intp)
+        pixel_value = np.empty(sum(hits), dtype=dtype)
+        start = 0
+        for (mask, (row_start, row_stop, col_start, col_stop)), count, sag in zip(stencils, hits, sags):
+            rows, cols = np.nonzero(mask)
+            pixel_index[start:start + count] = (rows + row_start) * x.size + cols + col_start
+            pixel_value[start:start + count] = sag
+            start += count
+
+    profile_count(profiler, 'footprint_pixels', int(pixel_index.size))
+    if not stencils:
+        return np.full(size, np.nan, dtype=dtype)
+
+    with profile_stage(profiler, 'average'):
+        return _mean_by_pixel(pixel_index, pixel_value, size)
+
+
+#%% Smoothing
+# scipy.ndimage and scipy.signal are imported where they are used: they dominate the import time of
+# this module, and parsing, accumulation and fitting do not need them
+
+def _gaussian_kernel(sigma, radius):
+    # Same weights as ndimage.gaussian_filter uses along one axis
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 * np.power(offsets / sigma, 2))
+    return kernel / kernel.sum()
+
+
+def normalized_gaussian_filter(data, sigma, radius=None, use_fft=False):
+    # NaN-aware Gaussian smoothing by normalized convolution: the data (zero where NaN) and its
+    # validity mask are filtered separately and divided, so gaps do not bleed into their neighbours.
+    # The filter is separable; use_fft convolves each axis by FFT, which is faster for large sigma.
+    # Pixels with no valid data within the kernel radius are NaN. float32 data is filtered in float32.
+    dtype = np.result_type(data, np.float32)
+    if radius is None:
+        radius = int(4 * sigma + 0.5)
+
+    valid = np.isfinite(data)
+    values = np.where(valid, data, 0.0)
+    weights = valid.astype(dtype)
+
+    if use_fft:
+        from scipy import signal
+        kernel = _gaussian_kernel(sigma, radius)
+        for axis in range(data.ndim):
+            shape = [1] * data.ndim
+            shape[axis] = kernel.size
+            values = signal.fftconvolve(values, kernel.reshape(shape), mode='same', axes=axis)
+            weights = signal.fftconvolve(weights, kernel.reshape(shape), mode='same', axes=axis)
+        min_weight = 1e-12  # FFT round-off leaves tiny weights where there is no data
+    else:
+        from scipy import ndimage
+        values = ndimage.gaussian_filter(values, sigma, radius=radius, mode='constant')
+        weights = ndimage.gaussian_filter(weights, sigma, radius=radius, mode='constant')
+        min_weight = 0
+
+    smoothed_data = np.full(data.shape, np.nan, dtype=dtype)
+    np.divide(values, weights, out=smoothed_data, where=weights > min_weight)
+    return smoothed_data
+
+
+def import_smoothing(smoothing='gaussian', profiler=None):
+    # Load the scipy module smooth_map needs. The processors call this first so that the one-off
+    # import cost shows up as its own 'import_scipy' stage instead of inflating the first 'smooth' stage
+    with profile_stage(profiler, 'import_scipy'):
+        if smoothing == 'normalized_fft':
+            from scipy import signal
+        else:
+            from scipy import ndimage
+
+
+def smooth_map(data, sigma, radius, smoothing='gaussian'):
+    #   smoothing: 'gaussian' (ndimage.gaussian_filter, NaN propagates), 'normalized' (normalized
+    #   convolution) or 'normalized_fft' (normalized convolution computed by FFT)
+    if smoothing == 'gaussian':
+        from scipy import ndimage
+        return ndimage.gaussian_filter(data, sigma, radius=radius)
+    elif smoothing == 'normalized':
+        return normalized_gaussian_filter(data, sigma, radius=radius)
+    elif smoothing == 'normalized_fft':
+        return normalized_gaussian_filter(data, sigma, radius=radius, use_fft=True)
+    else:
+        raise ValueError('Smoothing ' + smoothing + ' not recognized!')
+
 
 #%% Spherometer measurement algorithms
 
+def load_readings(csv_file, reader, layout, profiler=None):
+    # csv_file is either a path or readings already parsed by measurement_io
+    # The profiler (if any) records the 'parse' stage and the number of valid readings
+    with profile_stage(profiler, 'parse'):
+        if isinstance(csv_file, np.ndarray):
+            readings = csv_file
+        else:
+            readings, skipped = reader(csv_file, layout)
+            if skipped:
+                warnings.warn('Skipped unreadable cells in ' + str(csv_file) + ': ' + format_skipped(skipped))
+
+    profile_count(profiler, 'readings', int(np.count_nonzero(readings['valid'])))
+    return readings
+
+
+def _concentric_reader(csv_file):
+    # Raw instrument .txt exports and csv files have their own readers. Parsed readings are checked
+    # first, so they are never formatted to a string just to look at a file extension
+    if not isinstance(csv_file, np.ndarray) and str(csv_file).lower().endswith('.txt'):
+        return read_concentric_txt
+    return read_concentric_csv
+
 
-def process_spherometer_grid(csv_file,size_of_square=3,number_of_squares=10,pixels_per_square=10,spherometer_diameter=11.5,object_diameter=28,ideal_sag=0.076,mirror_center_x = 5, mirror_center_y = 5):
+def _count_nan_fraction(profiler, cropped_data, mirror_extent):
+    # Share of the mirror that no footprint covered
+    if profiler is not None:
+        profiler.count('nan_fraction', float(np.mean(np.isnan(cropped_data[mirror_extent]))) if np.any(mirror_extent) else 0.0)
+
+
+def process_spherometer_grid(csv_file,size_of_square=3,number_of_squares=10,pixels_per_square=10,spherometer_diameter=11.5,object_diameter=28,ideal_sag=0.076,mirror_center_x = 5, mirror_center_y = 5, smoothing='gaussian', profiler=None, dtype=np.float64, footprint='hard'):
     
     #csv_file should be a 1D file representing values measured on a NxN grid
+    #(or the readings parsed from one by measurement_io.read_grid_csv)
+    #smoothing selects the Gaussian blur, see smooth_map
+    #profiler is an optional profiling.StageProfiler recording per-stage timings and counts
+    #dtype of the returned maps; np.float32 halves their memory
+    #footprint: 'hard' or 'area' (anti-aliased) footprint weighting, see accumulate_footprints
     
     #size_of_square, spherometer_diameter,object_diameter,ideal_sag are whatever units you like
     #Everything after that lives in tile space
@@ -17,139 +333,187 @@ def process_spherometer_grid(csv_file,size_of_square=3,number_of_squares=10,pixe
         
     sigma = 3 #size in pixels for Gaussian blurring
     
-    with open(csv_file, mode ='r', encoding='utf-8') as file:
-        reader = csv.reader(file)
-        data = list(reader)            
-    
+    readings = load_readings(csv_file, read_grid_csv, number_of_squares, profiler=profiler)
+    readings = readings[readings['valid']]
+
     #Set up coordinates for tile space
     x = np.linspace(0,number_of_squares,number_of_squares*pixels_per_square)
     y = np.linspace(0,number_of_squares,number_of_squares*pixels_per_square)
     
-    X,Y = np.meshgrid(x,y)
-    
-    #Initialize empty list that overlaying measurements will be attached to
-    fill_data = [[] for i in range(X.size)]
-    avg_data = list([0]*len(fill_data))
-    list_data = []
-
-    for num, sag in enumerate(data[0]):
-        if sag != '0':  #Exclude the junk '0's that were added to the .csv. 
-            x_pos = num % number_of_squares
-            y_pos = np.floor(num / number_of_squares)
-
-            distance_from_center = np.sqrt(np.power(X - x_pos, 2) + np.power(Y - y_pos, 2))
-            spher_extent = distance_from_center < spher_radius
-
-            #
-            sample_height = sag
-            list_data.append(float(sag))
-            coord = np.where(spher_extent)
-
-            for num, loc in enumerate(coord[0]):
-                index = loc * X.shape[0] + coord[1][num]
-                fill_data[index].append(float(sample_height))
-
-    for num, val in enumerate(fill_data):
-        if len(val) == 0:
-            avg_data[num] = np.nan
-        else:
-            avg_data[num] = np.mean(val)
+    avg_data = accumulate_footprints(x, y, readings['x'], readings['y'], readings['sag'], spher_radius,
+                                     profiler=profiler, dtype=dtype, footprint=footprint)
 
-    reshaped_data = np.reshape(avg_data, X.shape)
-    distance_from_center = np.sqrt(np.power(X - mirror_center_x, 2) + np.power(Y - mirror_center_y, 2))
-    mirror_extent = distance_from_center < mirror_radius
-    cropped_data = reshaped_data.copy()
+    #The accumulated map is owned here, so it is cropped in place once it has been smoothed
+    cropped_data = np.reshape(avg_data, (y.size, x.size))
+    distance_from_center = np.sqrt(np.power(x[np.newaxis, :] - mirror_center_x, 2) + np.power(y[:, np.newaxis] - mirror_center_y, 2))
+    outside = ~(distance_from_center < mirror_radius)
+    mirror_extent = ~outside
 
-    smoothed_data = ndimage.gaussian_filter(cropped_data, sigma, radius=3)
-    smoothed_data[~mirror_extent] = np.nan
+    import_smoothing(smoothing, profiler=profiler)
+    with profile_stage(profiler, 'smooth'):
+        smoothed_data = smooth_map(cropped_data, sigma, 3, smoothing=smoothing)
+        smoothed_data[outside] = np.nan
 
-    cropped_data[~mirror_extent] = np.nan
+    cropped_data[outside] = np.nan
+    _count_nan_fraction(profiler, cropped_data, mirror_extent)
 
     return cropped_data, smoothed_data, mirror_extent
 
 
-def process_spherometer_concentric(csv_file, measurement_radius=[11.875, 8.5, 5.25, 2], spherometer_diameter=11.5,
-                                   object_diameter=32, number_of_pixels=256, crop_clear_aperture=False,sag_unit='in'):
-    spher_radius = spherometer_diameter / 2
+def concentric_axes(object_diameter, number_of_pixels, overfill=0):
+    # Pixel coordinates along each axis of a concentric map, centered on the mirror
     mirror_radius = object_diameter / 2
-    overfill = 0
-    gauss_filter_radius = 7
-    sigma = 7  # size in pixels for Gaussian blurring
-    ca_OD = 30
-    ca_ID = 3
-
-    with open(csv_file, mode='r', encoding='utf-8-sig') as file:
-        reader = csv.reader(file)
-        data = list(reader)
 
-        # Set up coordinates for tile space
+    # Set up coordinates for tile space
     x = np.linspace(-mirror_radius * (1 + overfill / 2), mirror_radius * (1 + overfill / 2),
                     int(number_of_pixels * (1 + overfill)))
     y = np.linspace(-mirror_radius * (1 + overfill / 2), mirror_radius * (1 + overfill / 2),
                     int(number_of_pixels * (1 + overfill)))
+    return x, y
 
-    X, Y = np.meshgrid(x, y)
-
-    # Initialize empty list that overlaying measurements will be attached to
-    fill_data = [[] for i in range(X.size)]
-    avg_data = list([0] * len(fill_data))
-    list_data = []
-
-    for meas_index, measurement_set in enumerate(data):
-        radius = measurement_radius[meas_index]
-        meas_bool = [(x != "" and x != "0") for x in measurement_set]
-        meas_data = [i for indx, i in enumerate(measurement_set) if meas_bool[indx]]
-
-        theta = np.linspace(0, 2 * np.pi, len(meas_data), endpoint=False)
-
-        for num, sag in enumerate(meas_data):
-            try:
-                x_pos = radius * np.cos(theta[num])
-                y_pos = radius * np.sin(theta[num])
-
-                distance_from_center = np.sqrt(np.power(X - x_pos, 2) + np.power(Y - y_pos, 2))
-                spher_extent = distance_from_center < spher_radius
-                #
-                if sag_unit == 'in':
-                    list_data.append(float(sag))
-                elif sag_unit == 'mm':
-                    list_data.append(float(sag))
-                else:
-                    return None, print('Sag unit ' + sag_unit + ' not recognized!')
-
-                coord = np.where(spher_extent)
-
-                for num, loc in enumerate(coord[0]):
-                    index = loc * X.shape[0] + coord[1][num]
-                    fill_data[index].append(float(sag))
-            except ValueError:
-                continue
-
-    for num, val in enumerate(fill_data):
-        if len(val) == 0:
-            avg_data[num] = np.nan
-        else:
-            avg_data[num] = np.mean(val)
 
-    reshaped_data = np.reshape(avg_data, X.shape)
-    distance_from_center = np.sqrt(np.power(X, 2) + np.power(Y, 2))
-    mirror_extent = distance_from_center < mirror_radius
-    cropped_data = reshaped_data.copy()
+def finish_concentric_map(reshaped_data, x, y, object_diameter, crop_clear_aperture=False, sag_unit='in',
+                          smoothed_data=None, smoothing='gaussian', copy=True, smoothing_sigma=None):
+    # Unit conversion, Gaussian smoothing (see smooth_map) and cropping of an accumulated concentric sag map
+    # smoothed_data (in inches) replaces the smoothed map when given, e.g. a fitted model
+    # copy=False converts and crops reshaped_data in place, for callers that own it
+    # The maps keep the dtype of reshaped_data
+    # smoothing_sigma: Gaussian sigma in the units of x, y (in). The default of 7 pixels blurs a different
+    # physical width at every number_of_pixels, which is what makes low resolution maps read a different
+    # mean ROC; a fixed width (about 0.88" matches 7 pixels at 256 px on a 32" mirror) removes that
+    check_sag_unit(sag_unit)
+    mirror_radius = object_diameter / 2
+    gauss_filter_radius = 7
+    sigma = 7  # size in pixels for Gaussian blurring
+    ca_OD = 30
+    ca_ID = 3
+
+    if smoothing_sigma is not None:
+        sigma = smoothing_sigma / (x[1] - x[0])
+        gauss_filter_radius = max(int(round(sigma)), 1)  # Truncated at one sigma, like the default
+
+    distance_from_center = np.sqrt(np.power(x[np.newaxis, :], 2) + np.power(y[:, np.newaxis], 2))
+    cropped_data = reshaped_data.copy() if copy else reshaped_data
 
     if not sag_unit == 'in':
-        cropped_data = cropped_data / 25.4
+        cropped_data /= 25.4
 
-    smoothed_data = ndimage.gaussian_filter(cropped_data, sigma, radius=gauss_filter_radius)
+    if smoothed_data is None:
+        smoothed_data = smooth_map(cropped_data, sigma, gauss_filter_radius, smoothing=smoothing)
+    else:
+        smoothed_data = np.asarray(smoothed_data, dtype=cropped_data.dtype)
 
     if crop_clear_aperture:
         mirror_OD = distance_from_center < ca_OD/2
         mirror_ID = distance_from_center > ca_ID/2
-        mirror_ID = distance_from_center > ca_ID/2
         mirror_extent = mirror_OD * mirror_ID
     else:
         mirror_extent = distance_from_center < mirror_radius
 
-    smoothed_data[~mirror_extent] = np.nan
-    cropped_data[~mirror_extent] = np.nan
+    outside = ~mirror_extent
+    smoothed_data[outside] = np.nan
+    cropped_data[outside] = np.nan
 
     return cropped_data, smoothed_data, mirror_extent
+
+
+def process_spherometer_concentric(csv_file, measurement_radius=[11.875, 8.5, 5.25, 2], spherometer_diameter=11.5,
+                                   object_diameter=32, number_of_pixels=256, crop_clear_aperture=False,sag_unit='in',
+                                   reconstruction='raster', zernike_order=2, smoothing='gaussian', profiler=None,
+                                   dtype=np.float64, footprint='hard', smoothing_sigma=None):
+    # csv_file is a concentric csv (one row per measurement radius), a raw instrument .txt export, or
+    # readings parsed from either by measurement_io; unreadable cells are skipped with a warning
+    # reconstruction: 'raster' smooths the footprint raster (smoothing selects the filter, see smooth_map),
+    # 'zernike' evaluates a least squares Zernike fit of order zernike_order to the readings
+    # (see fit_spherometer_concentric)
+    # profiler: optional profiling.StageProfiler recording per-stage timings and counts
+    # dtype: dtype of the returned maps; np.float32 halves their memory for high resolution maps
+    # footprint: 'hard' or 'area' (anti-aliased) footprint weighting, see accumulate_footprints
+    # smoothing_sigma: Gaussian sigma in inches instead of 7 pixels, see finish_concentric_map
+    spher_radius = spherometer_diameter / 2
+
+    check_sag_unit(sag_unit)
+
+    reader = _concentric_reader(csv_file)
+    readings = load_readings(csv_file, reader, measurement_radius, profiler=profiler)
+    readings = readings[readings['valid']]
+
+    x, y = concentric_axes(object_diameter, number_of_pixels)
+
+    avg_data = accumulate_footprints(x, y, readings['x'], readings['y'], readings['sag'], spher_radius,
+                                     profiler=profiler, dtype=dtype, footprint=footprint)
+    reshaped_data = np.reshape(avg_data, (y.size, x.size))
+
+    if reconstruction == 'raster':
+        smoothed_data = None
+        import_smoothing(smoothing, profiler=profiler)
+    elif reconstruction == 'zernike':
+        with profile_stage(profiler, 'zernike_fit'):
+            coefficients, residual_rms = fit_zernike(readings['x'], readings['y'], _sag_in_inches(readings['sag'], sag_unit),
+                                                     object_diameter / 2, max_order=zernike_order)
+            smoothed_data = evaluate_zernike(coefficients, x[np.newaxis, :], y[:, np.newaxis], object_diameter / 2)
+    else:
+        raise ValueError('Reconstruction ' + reconstruction + ' not recognized!')
+
+    with profile_stage(profiler, 'smooth'):
+        cropped_data, smoothed_data, mirror_extent = finish_concentric_map(reshaped_data, x, y, object_diameter,
+                                                                           crop_clear_aperture=crop_clear_aperture,
+                                                                           sag_unit=sag_unit, smoothed_data=smoothed_data,
+                                                                           smoothing=smoothing, copy=False,
+                                                                           smoothing_sigma=smoothing_sigma)
+    _count_nan_fraction(profiler, cropped_data, mirror_extent)
+
+    return cropped_data, smoothed_data, mirror_extent
+
+
+def check_sag_unit(sag_unit):
+    # Raise before any processing if sag readings are in a unit the processors do not convert
+    if sag_unit not in SAG_UNITS:
+        raise ValueError('Sag unit ' + str(sag_unit) + ' not recognized!')
+
+
+def _sag_in_inches(sags, sag_unit):
+    if not sag_unit == 'in':
+        return sags / 25.4
+    return sags
+
+
+def fit_spherometer_concentric(csv_file, measurement_radius=[11.875, 8.5, 5.25, 2], spherometer_diameter=11.5,
+                               object_diameter=32, sag_unit='in', concave=True, zernike_order=2):
+    # Zernike fit of the sag readings over the mirror, without building a raster
+    #   Returns a dict with the fitted 'coefficients' (sag in inches, keyed by term name),
+    #   'residual_rms' (in), 'mean_roc' (mm, from the piston term), 'astigmatism' (sag amplitude, in)
+    #   and 'astigmatism_roc' (peak ROC departure caused by astigmatism, mm)
+    check_sag_unit(sag_unit)
+
+    reader = _concentric_reader(csv_file)
+    readings = load_readings(csv_file, reader, measurement_radius)
+    readings = readings[readings['valid']]
+
+    coefficients, residual_rms = fit_zernike(readings['x'], readings['y'], _sag_in_inches(readings['sag'], sag_unit),
+                                             object_diameter / 2, max_order=zernike_order)
+    mean_sag = coefficients['piston']
+    astigmatism = np.hypot(coefficients.get('astig_0', 0.0), coefficients.get('astig_45', 0.0))
+
+    return {'coefficients': coefficients,
+            'residual_rms': residual_rms,
+            'mean_roc': compute_roc(mean_sag, spherometer_diameter, concave=concave),
+            'astigmatism': astigmatism,
+            'astigmatism_roc': np.abs(compute_roc(mean_sag - astigmatism, spherometer_diameter, concave=concave)
+                                      - compute_roc(mean_sag + astigmatism, spherometer_diameter, concave=concave)) / 2}
+
+
+def compute_roc(smoothed_data, spherometer_diameter, concave=True, out=None):
+    # Radius of curvature (mm) from sag (in) measured with a spherometer of the given diameter (in)
+    # The +/- 0.25/2 term accounts for the contact ball radius on concave and convex surfaces
+    #   25.4 * ((D^2/4 + s^2) / (2|s|) +/- 0.25/2), evaluated in place in the output (and one temporary)
+    #   out: optional preallocated array for the result; it may be smoothed_data itself
+    # The denominator is taken before out is written, so computing in place over the sag is safe
+    denominator = np.abs(smoothed_data)
+    denominator *= 2
+    roc = np.power(smoothed_data, 2, out=out)
+    roc += spherometer_diameter ** 2 / 4
+    roc /= denominator
+    roc += 0.25 / 2 if concave else -0.25 / 2
+    roc *= 25.4
+    return roc
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Low order surface models for sparse spherometer readings
+
+Fits Zernike polynomials over the mirror aperture directly to the readings by least squares,
+so the model can be evaluated on any output grid without a raster in between.
+Polynomials are unnormalized (peak value 1) and their mean over the aperture is zero except
+for piston, so the piston coefficient is the mean sag over the mirror.
+"""
+
+from math import factorial
+
+import numpy as np
+
+# (n, m, name) in order of increasing radial order
+ZERNIKE_TERMS = [(0, 0, 'piston'),
+                 (1, 1, 'tilt_x'),
+                 (1, -1, 'tilt_y'),
+                 (2, 0, 'defocus'),
+                 (2, 2, 'astig_0'),
+                 (2, -2, 'astig_45'),
+                 (3, 1, 'coma_x'),
+                 (3, -1, 'coma_y'),
+                 (3, 3, 'trefoil_0'),
+                 (3, -3, 'trefoil_30'),
+                 (4, 0, 'spherical')]
+
+
+def zernike_terms(max_order):
+    return [term for term in ZERNIKE_TERMS if term[0] <= max_order]
+
+
+def zernike(n, m, rho, theta):
+    radial = np.zeros_like(rho)
+    for k in range((n - abs(m)) // 2 + 1):
+        radial += ((-1) ** k * factorial(n - k)
+                   / (factorial(k) * factorial((n + abs(m)) // 2 - k) * factorial((n - abs(m)) // 2 - k))
+                   * rho ** (n - 2 * k))
+    if m > 0:
+        return radial * np.cos(m * theta)
+    elif m < 0:
+        return radial * np.sin(-m * theta)
+    return radial
+
+
+def _design_matrix(x, y, radius, terms):
+    rho = np.hypot(x, y) / radius
+    theta = np.arctan2(y, x)
+    return np.stack([zernike(n, m, rho, theta) for n, m, name in terms], axis=-1)
+
+
+def fit_zernike(x, y, values, radius, max_order=2):
+    #   x, y: reading positions, same units as radius (the mirror radius)
+    #   values: one value per reading
+    #   Returns (coefficients, residual_rms); coefficients maps term name to value
+    terms = zernike_terms(max_order)
+    values = np.asarray(values, dtype=float)
+    if values.size < len(terms):
+        raise ValueError('Need at least ' + str(len(terms)) + ' readings for a fit of order ' + str(max_order)
+                         + ', got ' + str(values.size))
+
+    design = _design_matrix(np.asarray(x, dtype=float), np.asarray(y, dtype=float), radius, terms)
+    solution = np.linalg.lstsq(design, values, rcond=None)[0]
+    residual_rms = np.sqrt(np.mean(np.power(values - design @ solution, 2)))
+    return {name: value for (n, m, name), value in zip(terms, solution)}, residual_rms
+
+
+def evaluate_zernike(coefficients, x, y, radius):
+    # Model value at every (x, y); x and y broadcast against each other
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+    terms = [term for term in ZERNIKE_TERMS if term[2] in coefficients]
+    rho = np.hypot(x, y) / radius
+    theta = np.arctan2(y, x)
+
+    surface = np.zeros(x.shape)
+    for n, m, name in terms:
+        surface += coefficients[name] * zernike(n, m, rho, theta)
+    return surface
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic spherometer measurements
+
+Writes measurement files in the concentric (one row per ring) and grid (one row of N x N squares)
+layouts from a known surface: a sphere of given ROC plus optional Zernike aberrations and noise.
+Sags are those of a ring spherometer, with the contact ball radius folded in the same way
+compute_roc removes it, so processing a noise-free sphere recovers its ROC.
+"""
+
+import csv
+
+import numpy as np
+
+from surface_fit import evaluate_zernike
+
+
+def _sphere_radius(roc, concave=True):
+    # Radius (in) seen by the spherometer so that compute_roc returns roc (mm)
+    return roc / 25.4 - 0.25 / 2 if concave else roc / 25.4 + 0.25 / 2
+
+
+def spherometer_sag(x_pos, y_pos, spherometer_diameter=11.5, roc=5275, concave=True, aberrations=None,
+                    mirror_radius=16, contact_points=90):
+    #   x_pos, y_pos: spherometer centers on the mirror (in)
+    #   roc: radius of curvature of the underlying sphere (mm)
+    #   aberrations: Zernike coefficients (surface departure in inches, positive deepening a concave
+    #   surface), keyed by surface_fit term name
+    #   Returns the sag (in) read at every position. On the sphere the spherometer reads the exact
+    #   sagitta of its ring wherever it sits; aberrations add the mean departure under the contact
+    #   ring minus the departure under the center probe.
+    radius = _sphere_radius(roc, concave)
+    sag = np.full(np.broadcast(np.asarray(x_pos), np.asarray(y_pos)).shape,
+                  radius - np.sqrt(radius ** 2 - (spherometer_diameter / 2) ** 2))
+    if not aberrations:
+        return sag
+
+    x_pos = np.asarray(x_pos, dtype=float)[..., np.newaxis]
+    y_pos = np.asarray(y_pos, dtype=float)[..., np.newaxis]
+    theta = np.linspace(0, 2 * np.pi, contact_points, endpoint=False)
+    ring = evaluate_zernike(aberrations, x_pos + spherometer_diameter / 2 * np.cos(theta),
+                            y_pos + spherometer_diameter / 2 * np.sin(theta), mirror_radius).mean(axis=-1)
+    center = evaluate_zernike(aberrations, x_pos, y_pos, mirror_radius)[..., 0]
+    return sag + (ring - center) if concave else sag - (ring - center)
+
+
+def _format_sags(sags, noise, sag_unit, rng):
+    sags = sags + rng.normal(0, noise, np.shape(sags)) if noise else sags
+    if sag_unit == 'mm':
+        sags = sags * 25.4
+    return ['%.8f' % sag for sag in sags]
+
+
+def write_concentric_measurement(csv_file, measurement_radius=[11.875, 8.5, 5.25, 2], readings_per_ring=[24, 18, 12, 6],
+                                 spherometer_diameter=11.5, object_diameter=32, roc=5275, concave=True, aberrations=None,
+                                 noise=0, sag_unit='in', seed=None):
+    #   noise: standard deviation of the sag noise (in)
+    #   Readings start at angle 0 on every ring and are equally spaced, as process_spherometer_concentric assumes
+    rng = np.random.default_rng(seed)
+    rows = []
+    for radius, count in zip(measurement_radius, readings_per_ring):
+        theta = np.linspace(0, 2 * np.pi, count, endpoint=False)
+        sags = spherometer_sag(radius * np.cos(theta), radius * np.sin(theta), spherometer_diameter, roc, concave,
+                               aberrations, object_diameter / 2)
+        rows.append(_format_sags(sags, noise, sag_unit, rng))
+
+    with open(csv_file, 'w', newline='') as file:
+        csv.writer(file).writerows(rows)
+
+
+def write_grid_measurement(csv_file, number_of_squares=10, size_of_square=3, spherometer_diameter=11.5,
+                           object_diameter=28, mirror_center_x=5, mirror_center_y=5, roc=5275, concave=True,
+                           aberrations=None, noise=0, sag_unit='in', seed=None):
+    #   Squares whose center is off the object are written as '0', like the measured grid files
+    #   Positions follow process_spherometer_grid: square num sits at (num % N, num // N) tiles
+    rng = np.random.default_rng(seed)
+    num = np.arange(number_of_squares ** 2)
+    x_pos = (num % number_of_squares - mirror_center_x) * size_of_square
+    y_pos = (num // number_of_squares - mirror_center_y) * size_of_square
+
+    sags = spherometer_sag(x_pos, y_pos, spherometer_diameter, roc, concave, aberrations, object_diameter / 2)
+    row = _format_sags(sags, noise, sag_unit, rng)
+    for index in np.flatnonzero(np.hypot(x_pos, y_pos) >= object_diameter / 2):
+        row[index] = '0'
+
+    with open(csv_file, 'w', newline='') as file:
+        csv.writer(file).writerow(row)